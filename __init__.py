@@ -1,5 +1,25 @@
 # from .epuck import EPuck
 # import epuck
-from .epuck_com import EPuckCom
-from .epuck_ip import EPuckIP
-from .epuck_state import *
\ No newline at end of file
+from .epuck_state import *
+from .epuck_registry import open_epuck, register_transport
+
+#transport classes are imported on first use, so importing the package doesn't load pyserial
+_LAZY = {"EPuckCom": ".epuck_com", "EPuckIP": ".epuck_ip"}
+
+#star imports resolve the lazy names through __getattr__, so they stay lazy until then
+import types as _types
+from . import epuck_state as _epuck_state
+__all__ = ([name for name in dir(_epuck_state)
+            if not name.startswith("_") and not isinstance(getattr(_epuck_state, name), _types.ModuleType)] +
+           ["open_epuck", "register_transport"] + list(_LAZY))
+
+def __getattr__(name):
+    if (name in _LAZY):
+        import importlib
+        value = getattr(importlib.import_module(_LAZY[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError("module "+repr(__name__)+" has no attribute "+repr(name))
+
+def __dir__():
+    return sorted(list(globals()) + list(_LAZY))
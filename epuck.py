@@ -1,9 +1,9 @@
 import struct
 from abc import ABC, abstractmethod
 import time
-from doctest import debug
 
 from .epuck_state import *
+from .epuck_stats import LinkStats, PACKET_SENSOR
 
 ###Constants for user use
 CAM_MODE_RGB565 = 1
@@ -19,17 +19,32 @@ class EPuck(ABC):
     enable_camera = False     #when enabled, requests and gets camera frame each update.
     enable_sensors = False     #when enabled, requests and gets camera frame each update.
 
-    state = EPuckState()
+    command_rate = None     #maximum commands per second, None for no limit. Faster commands are merged into the next one
+    skip_unchanged_commands = True   #don't resend a command identical to the last one sent
+
+    stats = None   #LinkStats, see enable_stats
+    frame_store = None   #FrameStore camera frames are read into, set by FrameStore.attach
+    frame_store_id = 0   #robot id of this robot's frames in frame_store
+
+    _frame_decoder = None  #created on first use of get_frame_array
 
     def __init__(self, debug=False, timeout=10):  #timeout in s
         self._debug = debug
         self._timeout = timeout
+        self.state = EPuckState()   #each robot has its own state
+        self._sensor_listeners = []
+        self._last_command = None    #last command packet written to the robot
+        self._last_command_time = 0.0
+        self._command_pending = False   #a command was deferred by command_rate
+        self._request_time = None   #perf_counter of the first write since the last sensor packet, for stats
+        self._rx_time = 0.0   #monotonic time anything was last received, for connection health checks
 
     def __str__(self):
         return str(self.state)
 
-    def _debug_print(self, msg):
-        if(self._debug): print(self.__class__.__name__+": "+msg)
+    #msg is %-formatted with args only when debugging, so hot paths don't build strings
+    def _debug_print(self, msg, *args):
+        if(self._debug): print(self.__class__.__name__+": "+(msg % args if args else msg))
 
     ### COMM methods
     def connect(self):
@@ -37,6 +52,7 @@ class EPuck(ABC):
         if (not self._internal_connect()):   
             self._debug_print("failed to connect")
             return False
+        self._last_command = None   #robot state unknown, next command must be sent
         self._debug_print(f"connected")
         return True
 
@@ -48,20 +64,95 @@ class EPuck(ABC):
     def close(self):
         pass
     
-    #send a robot command using the configured state variables
-    def send_command(self):
+    #send a robot command using the configured state variables. Unchanged commands are skipped and commands faster
+    # than command_rate are deferred to flush_command, unless forced. Returns True if the command was written.
+    def send_command(self, force=False):
+        if (not force and self.command_rate is not None and
+                time.monotonic() - self._last_command_time < 1.0/self.command_rate):
+            self._command_pending = True
+            return False
+        packet = self._make_command_packet()
+        if (not force and self.skip_unchanged_commands and packet == self._last_command):
+            self._command_pending = False
+            if (self.stats is not None): self.stats.commands_skipped += 1
+            return False
+        self._write_command(packet)
+        return True
+
+    #send a command deferred by command_rate, once it is due
+    def flush_command(self):
+        if (self._command_pending): self.send_command()
+
+    def _write_command(self, packet):
         self._debug_print("sending command")
-        self._writeData(self._make_command_packet())
+        self._timed_write(packet)
         self._debug_print("command sent")
+        self._last_command = packet
+        self._last_command_time = time.monotonic()
+        self._command_pending = False
         self.state.act_speaker_sound = SOUND_NOCHANGE #to avoid re-starting sound each time, only do once.
         
     #stop motion, sound, etc.
     def stop_all(self):
         self.state.stop_all()
         self._debug_print("issuing stop command")
-        self.send_command()
+        self.send_command(force=True)
         time.sleep(2)  #add a sleep because its common to just close after before the buffer is clear
     
+    #decode the latest camera frame into a numpy array (HxWx3 for RGB565, HxW for grey).
+    # the returned array is reused by the next call unless out is given, copy it if you need to keep it.
+    def get_frame_array(self, out=None):
+        if (self._frame_decoder is None):
+            from .epuck_camera import FrameDecoder   #numpy is only imported when frames are decoded
+            self._frame_decoder = FrameDecoder()
+        return self._frame_decoder.decode_state(self.state, out)
+
+    #listener(robot, packet) is called with the raw packet each time a sensor packet has been loaded into state.
+    # it runs on the receive path so it should be quick.
+    def add_sensor_listener(self, listener):
+        self._sensor_listeners.append(listener)
+
+    def remove_sensor_listener(self, listener):
+        self._sensor_listeners.remove(listener)
+
+    ### instrumentation
+    #start collecting link statistics, returns the LinkStats
+    def enable_stats(self):
+        if (self.stats is None): self.stats = LinkStats()
+        return self.stats
+
+    def disable_stats(self):
+        self.stats = None
+
+    #write a packet, timing it when stats are enabled
+    def _timed_write(self, packet):
+        stats = self.stats
+        if (stats is None):
+            self._writeData(packet)
+            return
+        start = time.perf_counter()
+        self._writeData(packet)
+        stats.record_write(len(packet), time.perf_counter() - start)
+        if (self._request_time is None): self._request_time = start
+
+    #record a received packet of type kind (epuck_stats.PACKET_*) whose read started at start (perf_counter)
+    def _record_packet(self, kind, size, start):
+        now = time.perf_counter()
+        self.stats.record_packet(kind, size, now - start)
+        if (kind == PACKET_SENSOR and self._request_time is not None):
+            self.stats.roundtrip.record(now - self._request_time)
+            self._request_time = None
+
+    #bookkeeping for every sensor or camera packet received
+    def _mark_received(self):
+        self.state.rx_sequence += 1
+        self.state.rx_timestamp = time.time()
+        self._rx_time = time.monotonic()
+
+    #prompt the robot to send something, used by epuck_connection to check an idle link is still alive
+    def _heartbeat(self):
+        self.send_command(force=True)
+
     ### Com method specific commands
     
     #do whatever is needed to update data based on the com method
@@ -80,6 +171,13 @@ class EPuck(ABC):
     @abstractmethod
     def _readData(self, size):
         pass
+
+    #read directly into a preallocated buffer (bytearray or memoryview), returns the number of bytes read.
+    # transports should override this to avoid the intermediate copy.
+    def _readDataInto(self, buffer):
+        data = self._readData(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
     
     ### Robot Level Commands
     @abstractmethod   
@@ -135,26 +233,6 @@ class EPuck(ABC):
         return command
     
     def _parse_sensors_packet(self, response):
-        data = struct.unpack("<"+   #epuck is in little endian
-                "3h"+  #accelerometer axes X Y Z
-                "3f"+  #acceleration, orientation, inclination
-                "3h"+   #gyro X Y Z axis values
-                "3f"+   #magnetometer X Y Z axes
-                "B"+   #Temperature in c
-                "HHHHHHHH"+ #proximity sensors
-                "HHHHHHHH"+ #ambient light sensors
-                "H"+    #tof
-                "HHHH" +    #microphones
-                "HH" +   #motors L/R
-                "H"  +   #battery level
-                "?"  +   #SD present
-                "xxx" +  # Rc5 TV protocol, ignored
-                "B" +   #selector
-                "HHH" + #ground proximity
-                "HHH" +  #ground ambient
-                "?"   +  #button
-                "B",
-                response)
-        self.state.load_data(data)
-
-
+        self.state.load_packet(response)
+        for listener in self._sensor_listeners:
+            listener(self, response)
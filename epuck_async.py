@@ -0,0 +1,388 @@
+import asyncio
+import sys
+import time
+from epuck import epuck
+from epuck.epuck_ip import EPuckIP
+from epuck.epuck_com import EPuckCom
+
+# asyncio counterparts of EPuckIP and EPuckCom. One event loop can drive many robots without a thread per robot.
+# Packet building and parsing is shared with the blocking transports; only the I/O is asynchronous.
+#
+#   robot = AsyncEPuckIP("192.168.1.5")
+#   await robot.connect()
+#   robot.enable_sensors = True
+#   async for packet in robot.packets():
+#       ...use robot.state...
+#       await robot.send_command()
+
+class AsyncEPuck(epuck.EPuck):
+    #async versions of the EPuck methods that perform I/O
+
+    async def connect(self):
+        self._debug_print("attempting to connect")
+        if (not await self._internal_connect()):
+            self._debug_print("failed to connect")
+            return False
+        self._debug_print(f"connected")
+        return True
+
+    #force is accepted for the signature of EPuck.send_command, async commands are always sent. Returns True
+    async def send_command(self, force=False):
+        self._debug_print("sending command")
+        await self._writeData(self._make_command_packet())
+        self._debug_print("command sent")
+        self.state.act_speaker_sound = epuck.SOUND_NOCHANGE #to avoid re-starting sound each time, only do once.
+        return True
+
+    async def stop_all(self):
+        self.state.stop_all()
+        self._debug_print("issuing stop command")
+        await self.send_command()
+        await self._flush()
+
+    #prompt the robot to send something, see EPuck._heartbeat
+    async def _heartbeat(self):
+        await self.send_command(force=True)
+
+    async def _readDataInto(self, buffer):
+        data = await self._readData(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    #wait until written data has left the host
+    async def _flush(self):
+        pass
+
+    #async iterator of received packets, yields the packet signature. The newest data is always in state; if the
+    # consumer is slower than the robot intermediate packets are skipped. Stops when the connection is lost or
+    # neither enable_sensors nor enable_camera is set, as nothing would arrive.
+    async def packets(self):
+        while (self.is_connected() and (self.enable_sensors or self.enable_camera)):
+            packet = await self.data_update()
+            if (packet is not None):
+                yield packet
+            else:
+                await asyncio.sleep(0)   #data_update may not have suspended, let other tasks run
+
+
+class AsyncEPuckIP(AsyncEPuck):
+    ### protocol constants and packet building shared with EPuckIP
+    _CMD_COMMAND_PACKET = EPuckIP._CMD_COMMAND_PACKET
+    _CMD_CAMERA_PACKET = EPuckIP._CMD_CAMERA_PACKET
+    _CMD_SENSOR_PACKET = EPuckIP._CMD_SENSOR_PACKET
+    _CMD_EMPTY_PACKET = EPuckIP._CMD_EMPTY_PACKET
+    _CMD_CAMERA_STREAM_BIT = EPuckIP._CMD_CAMERA_STREAM_BIT
+    _CMD_SENSORS_STREAM_BIT = EPuckIP._CMD_SENSORS_STREAM_BIT
+
+    _make_command_packet = EPuckIP._make_command_packet
+    get_camera_parameters = EPuckIP.get_camera_parameters
+    set_camera_parameters = EPuckIP.set_camera_parameters
+
+    #internal state
+    _camera_enabled = False
+    _sensors_enabled = False
+    _isOpen = False
+
+    def __init__(self, ip, port=1000, debug=False, timeout=10): #timeout in s
+        super().__init__(debug, timeout)
+        self._port = port
+        self._ip = ip
+        self._reader = None
+        self._writer = None
+        self._receive_task = None
+        self._received = None    #asyncio.Condition, notified for every sensor/camera packet
+        self._last_packet = None
+        self._sensor_buffer = bytearray(epuck._RESPONSE_PACKET_LEN)
+
+    ### COMM methods
+    async def _internal_connect(self):
+        try:
+            self._reader, self._writer = await asyncio.wait_for(
+                asyncio.open_connection(self._ip, self._port), self._timeout)
+            self._isOpen = True
+        except (OSError, asyncio.TimeoutError):
+            self._isOpen = False
+        if (self._isOpen):
+            self.get_camera_parameters()
+            self._received = asyncio.Condition()
+            self._receive_task = asyncio.create_task(self._receiver_loop())
+        return self._isOpen
+
+    def is_connected(self):
+        return self._isOpen
+
+    async def close(self):
+        self._isOpen = False
+        if (self._receive_task is not None):
+            self._receive_task.cancel()
+            self._receive_task = None
+        if (self._writer is not None):
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except OSError:
+                pass
+
+    async def _writeData(self, packet):
+        self._writer.write(packet)
+        await self._writer.drain()
+
+    async def _readData(self, size):
+        try:
+            return await self._reader.readexactly(size)
+        except (asyncio.IncompleteReadError, OSError):
+            self._isOpen = False
+            return b''
+
+    async def _flush(self):
+        if (self._writer is not None): await self._writer.drain()
+
+    ### Robot Level Commands
+    #override to fix IP protocol bug, see EPuckIP.send_command
+    async def send_command(self, force=False):
+        song_command = not (self.state.act_speaker_sound == epuck.SOUND_NOCHANGE or self.state.act_speaker_sound == epuck.SOUND_STOP)
+        await super().send_command(force)
+        if (song_command): await super().send_command(force=True)
+        self._camera_enabled = self.enable_camera
+        self._sensors_enabled = self.enable_sensors
+        return True
+
+    #ensure the requested streams are active, then wait for the next sensor or camera packet (up to the timeout).
+    # returns the packet signature, or None if nothing arrived.
+    async def data_update(self):
+        if  ( (self.enable_camera != self._camera_enabled) or
+            (self.enable_sensors != self._sensors_enabled) ):
+            await self.send_command()
+
+        if (not (self.enable_camera or self.enable_sensors) or not self._isOpen):
+            return None
+
+        sequence = self.state.rx_sequence
+        async with self._received:
+            try:
+                await asyncio.wait_for(
+                    self._received.wait_for(lambda: self.state.rx_sequence != sequence or not self._isOpen), self._timeout)
+            except asyncio.TimeoutError:
+                return None
+        return self._last_packet if self.state.rx_sequence != sequence else None
+
+    #runs as a task: read packets as they arrive and decode them straight into state
+    async def _receiver_loop(self):
+        while (self._isOpen):
+            header = await self._readData(1)
+            if (len(header) < 1): break
+            match header[0]:
+                case self._CMD_CAMERA_PACKET:
+                    frame = await self._readData(self.state.cam_framebytes)
+                    if (len(frame) < self.state.cam_framebytes): break
+                    self.state.sens_framebuffer = frame
+
+                case self._CMD_SENSOR_PACKET:
+                    if (await self._readDataInto(self._sensor_buffer) < epuck._RESPONSE_PACKET_LEN): break
+                    self._parse_sensors_packet(self._sensor_buffer)
+
+                case self._CMD_EMPTY_PACKET:
+                    continue
+
+                case _:
+                    self._debug_print("unexpected packet signature %d", header[0])
+                    continue
+
+            self._mark_received()
+            self._last_packet = header[0]
+            async with self._received:
+                self._received.notify_all()
+
+        self._isOpen = False
+        async with self._received:
+            self._received.notify_all()
+
+
+class AsyncSerial():
+    #minimal asyncio adapter for a pyserial port. The port is opened non-blocking; on POSIX reads wait on the file
+    # descriptor with the event loop, elsewhere they poll.
+    _POLL_INTERVAL = 0.001  #s
+
+    def __init__(self, s_com):
+        self._s_com = s_com
+        self._loop = asyncio.get_running_loop()
+        self._fd = s_com.fileno() if (sys.platform != "win32" and hasattr(s_com, "fileno")) else None
+
+    @classmethod
+    async def open(cls, port, baud):
+        import serial   #pip install pyserial
+        loop = asyncio.get_running_loop()
+        s_com = await loop.run_in_executor(None, lambda: serial.Serial(port, baud, timeout=0))
+        return cls(s_com)
+
+    @property
+    def is_open(self):
+        return self._s_com.is_open
+
+    def close(self):
+        self._s_com.close()
+
+    def write(self, data):
+        self._s_com.write(data)
+
+    async def flush(self):
+        await self._loop.run_in_executor(None, self._s_com.flush)
+
+    #read exactly size bytes, or fewer if the timeout expires
+    async def read(self, size, timeout):
+        data = bytearray()
+        deadline = time.monotonic() + timeout
+        while (len(data) < size):
+            chunk = self._s_com.read(size - len(data))
+            if (chunk):
+                data.extend(chunk)
+                continue
+            remaining = deadline - time.monotonic()
+            if (remaining <= 0): break
+            await self._wait_readable(remaining)
+        return data
+
+    #read up to and including a newline
+    async def readline(self, size, timeout):
+        data = bytearray()
+        deadline = time.monotonic() + timeout
+        while (len(data) < size and not data.endswith(b'\n')):
+            chunk = self._s_com.read(1)
+            if (chunk):
+                data.extend(chunk)
+                continue
+            remaining = deadline - time.monotonic()
+            if (remaining <= 0): break
+            await self._wait_readable(remaining)
+        return data
+
+    async def _wait_readable(self, timeout):
+        if (self._fd is None):
+            await asyncio.sleep(min(timeout, self._POLL_INTERVAL))
+            return
+        ready = self._loop.create_future()
+        self._loop.add_reader(self._fd, lambda: ready.done() or ready.set_result(None))
+        try:
+            await asyncio.wait_for(ready, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self._loop.remove_reader(self._fd)
+
+
+class AsyncEPuckCom(AsyncEPuck):
+    ### protocol constants and packet building shared with EPuckCom
+    _MAX_READLINE = EPuckCom._MAX_READLINE
+    _CAM_HEADER_BYTES = EPuckCom._CAM_HEADER_BYTES
+    _CMD_GET_ALL_SENSORS = EPuckCom._CMD_GET_ALL_SENSORS
+    _CMD_SET_ALL_ACTUATORS = EPuckCom._CMD_SET_ALL_ACTUATORS
+    _CMD_GET_CAM_FRAME = EPuckCom._CMD_GET_CAM_FRAME
+    _CMD_GET_CAM_PARAMETERS = EPuckCom._CMD_GET_CAM_PARAMETERS
+    _CMD_SET_CAM_PARAMETERS = EPuckCom._CMD_SET_CAM_PARAMETERS
+
+    _make_command_packet = EPuckCom._make_command_packet
+
+    def __init__(self, port, baud=115200, debug=False, timeout=15):  #timeout in s
+        super().__init__(debug, timeout)
+        self._port = port
+        self._baud = baud
+        self._s_com = None
+        self._sensor_buffer = bytearray(epuck._RESPONSE_PACKET_LEN)
+
+    ### COMM methods
+    async def _internal_connect(self):
+        try:
+            self._s_com = await AsyncSerial.open(self._port, self._baud)
+        except Exception as error:
+            print(error)
+            self._s_com = None
+            return False
+        return True
+
+    def is_connected(self):
+        return self._s_com is not None and self._s_com.is_open
+
+    async def close(self):
+        if (self._s_com is not None): self._s_com.close()
+
+    async def _writeData(self, packet):
+        self._s_com.write(packet)
+
+    async def _readData(self, size):
+        return await self._s_com.read(size, self._timeout)
+
+    async def _flush(self):
+        await self._s_com.flush()
+
+    ### Robot Level Commands
+    async def set_camera_parameters(self, mode=epuck.CAM_MODE_RGB565, width=40, height=40, zoom=1, x=-1, y=-1):
+        if (x==-1): x=width
+        if (y==-1): y=height
+        command_string = f"{self._CMD_SET_CAM_PARAMETERS},{mode},{width},{height},{zoom},{x},{y}\n"
+
+        self._debug_print("setting camera parameters")
+        await self._writeData(command_string.encode("ascii"))
+        response = await self._s_com.readline(self._MAX_READLINE, self._timeout)
+        if (len(response) == 0 or response[0] != ord('j')):
+            print("ERR unexpected character returned from ascii command")
+            self.state.cam_framebytes = -1
+            return
+        (self.state.cam_mode, self.state.cam_width, self.state.cam_height, self.state.cam_zoom) = (mode, width, height, zoom)
+        self.state.cam_framebytes = width*height*(2 if mode == epuck.CAM_MODE_RGB565 else 1)
+
+    async def get_camera_parameters(self):
+        command_string = self._CMD_GET_CAM_PARAMETERS+"\n"
+
+        await self._writeData(command_string.encode("ascii"))
+        response = await self._s_com.readline(self._MAX_READLINE, self._timeout)
+        if (len(response) == 0 or response[0] != ord('i')):
+            print("ERR unexpected character returned from ascii command")
+            return
+        raw_data = response.decode("utf_8").rstrip().split(',')
+        (self.state.cam_mode, self.state.cam_width, self.state.cam_height, self.state.cam_zoom, self.state.cam_framebytes) = tuple(map(int,raw_data[1:]))
+
+    #For COM the command includes the request for data, see EPuckCom.send_command
+    async def send_command(self, force=False):
+        await self.data_update()
+        return True
+
+    #request data and await it. returns the signature of the last packet received (sensor or camera), or None
+    async def data_update(self):
+        if (not self.is_connected()):
+            return None
+        packet = None
+        await super().send_command()
+
+        if (self.enable_sensors):
+            count = await self._readDataInto(memoryview(self._sensor_buffer)[:epuck._RESPONSE_PACKET_LEN-1])
+            if (count < epuck._RESPONSE_PACKET_LEN-1):
+                await self._read_timeout()
+                return None
+            self._parse_sensors_packet(self._sensor_buffer)
+            self._mark_received()
+            packet = EPuckIP._CMD_SENSOR_PACKET
+
+        if (self.enable_camera):
+            if (self.state.cam_framebytes == -1):
+                await self.get_camera_parameters()
+            frame = await self._get_cam_frame()
+            if (frame is not None):
+                self.state.sens_framebuffer = frame
+                self._mark_received()
+                packet = EPuckIP._CMD_CAMERA_PACKET
+        return packet
+
+    async def _get_cam_frame(self):
+        await self._writeData(bytearray([self._CMD_GET_CAM_FRAME, 0]))
+        size = self.state.cam_framebytes+self._CAM_HEADER_BYTES
+        response = await self._readData(size)
+        if (len(response) < size):
+            await self._read_timeout()
+            return None
+        return response[self._CAM_HEADER_BYTES:]
+
+    #a response didn't arrive in time. The rest of it may still come and be taken for the next response, so close
+    # the port and leave it to a reconnect, see EPuckCom._read_timeout
+    async def _read_timeout(self):
+        self._debug_print("timed out waiting for a response, closing")
+        await self.close()
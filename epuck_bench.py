@@ -0,0 +1,247 @@
+import argparse
+import json
+import os
+import socket
+import sys
+import threading
+import time
+import tracemalloc
+from epuck import epuck
+from epuck.epuck_ip import EPuckIP
+from epuck.epuck_state import EPuckState, _SENSORS_STRUCT
+
+# Benchmarks for the protocol code: packet encoding, sensor decoding, camera frame handling, EPuckIP round trips
+# against a loopback stand-in and EPuckCom throughput over a pseudo-terminal.
+#
+#   python -m epuck.epuck_bench                          #run and print
+#   python -m epuck.epuck_bench --save bench.json        #store results as a baseline
+#   python -m epuck.epuck_bench --baseline bench.json    #compare, exit code 1 on regressions
+#
+# Every benchmark reports operations per second, p50/p99 latency per operation and the peak memory allocated
+# while it ran.
+
+_SAMPLE_VALUES = (1,2,3, 1.5,2.5,3.5, 4,5,6, 0.1,0.2,0.3, 25, *range(8), *range(10,18), 99, 1,2,3,4, 100,200, 3700,
+                  True, 7, 11,12,13, 21,22,23, True, 0)
+_SAMPLE_PACKET = _SENSORS_STRUCT.pack(*_SAMPLE_VALUES)
+
+
+#time count calls of fn, returns ops/s, p50 and p99 in microseconds and peak allocation in bytes
+def measure(fn, count):
+    for i in range(min(count, 100)):   #warm up
+        fn()
+    timings = [0]*count
+    clock = time.perf_counter_ns
+    for i in range(count):
+        start = clock()
+        fn()
+        timings[i] = clock() - start
+    total = sum(timings)
+
+    tracemalloc.start()
+    for i in range(min(count, 1000)):
+        fn()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings.sort()
+    return {
+        "ops_per_s": count*1e9/total if total else float("inf"),
+        "p50_us": timings[count//2]/1000,
+        "p99_us": timings[min(count-1, count*99//100)]/1000,
+        "peak_alloc_bytes": peak,
+    }
+
+
+### packet encoding / decoding
+def bench_encode(count):
+    robot = EPuckIP("127.0.0.1")
+    robot.state.act_left_motor_speed = 500
+    robot.state.act_rgb_led_colors[1] = (10, 20, 30)
+    results = {
+        "encode_command_core": measure(robot._make_command_packet_core, count),
+        "encode_command_ip": measure(robot._make_command_packet, count),
+    }
+    robot._socket.close()
+    return results
+
+def bench_decode(count):
+    robot = EPuckIP("127.0.0.1")
+    state = EPuckState()
+    results = {
+        "decode_parse_sensors_packet": measure(lambda: robot._parse_sensors_packet(_SAMPLE_PACKET), count),
+        "decode_load_data": measure(lambda: state.load_data(_SAMPLE_VALUES), count),
+        "decode_load_packet": measure(lambda: state.load_packet(_SAMPLE_PACKET), count),
+    }
+    robot._socket.close()
+    return results
+
+
+### camera frames
+def bench_camera(count):
+    from epuck.epuck_replay import EPuckReplay
+    results = {}
+    frame_packet = bytes([EPuckIP._CMD_CAMERA_PACKET]) + bytes(38400)
+    robot = EPuckReplay([(0.0, frame_packet)]*(count*3), speed=None)   #enough for warm up and allocation passes
+    robot.connect()
+    robot.enable_camera = True
+    robot._camera_enabled = True
+    results["camera_receive_ip"] = measure(robot._receive_packet, count)
+
+    try:
+        import numpy
+    except ImportError:
+        return results
+    robot.state.sens_framebuffer = bytearray(38400)
+    results["camera_decode_rgb565"] = measure(robot.get_frame_array, count)
+    robot.state.cam_mode, robot.state.cam_framebytes = epuck.CAM_MODE_GREY, 19200
+    robot.state.sens_framebuffer = bytearray(19200)
+    results["camera_decode_grey"] = measure(robot.get_frame_array, count)
+    return results
+
+
+### EPuckIP against a loopback stand-in that answers each command packet with a sensor packet
+def _loopback_robot(listener):
+    client, address = listener.accept()
+    client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    response = bytes([EPuckIP._CMD_SENSOR_PACKET]) + _SAMPLE_PACKET
+    received = bytearray()
+    while (True):
+        data = client.recv(4096)
+        if (not data): break
+        received.extend(data)
+        while (len(received) >= 21):
+            del received[:21]
+            client.sendall(response)
+    client.close()
+
+def bench_ip_roundtrip(count):
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1)
+    threading.Thread(target=_loopback_robot, args=(listener,), daemon=True).start()
+
+    robot = EPuckIP("127.0.0.1", listener.getsockname()[1])
+    robot.connect()
+    robot._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    robot.enable_sensors = True
+
+    def roundtrip():
+        sequence = robot.state.rx_sequence
+        robot.send_command(force=True)
+        while (robot.state.rx_sequence == sequence and robot.is_connected()):
+            robot._receive_packet()
+
+    results = {"ip_roundtrip": measure(roundtrip, count)}
+    robot.close()
+    listener.close()
+    return results
+
+
+### EPuckCom over a pseudo-terminal pair with a stand-in robot on the other end
+def _pty_robot(fd, frame_bytes):
+    sensors = _SAMPLE_PACKET[:epuck._RESPONSE_PACKET_LEN-1]
+    frame = bytes([epuck.CAM_MODE_GREY, 40, 40]) + bytes(frame_bytes)
+    received = bytearray()
+    try:
+        while (True):
+            received.extend(os.read(fd, 4096))
+            while (received):
+                if (received.startswith(b'I\n')):
+                    os.write(fd, b"i,0,40,40,1,"+str(frame_bytes).encode()+b"\r\n")
+                    del received[:2]
+                elif (received[0] == 0xF8):   #sensors
+                    os.write(fd, sensors)
+                    del received[:1]
+                elif (received[0] == 0xF7):   #actuators
+                    if (len(received) < 20): break
+                    del received[:20]
+                elif (received[0] == 0xB7):   #camera frame
+                    os.write(fd, frame)
+                    del received[:1]
+                elif (received[0] == 0):      #end of binary command
+                    del received[:1]
+                else:
+                    break
+    except OSError:
+        pass
+
+def bench_com_pty(count):
+    if (sys.platform == "win32"):
+        return {}
+    import tty
+    from epuck.epuck_com import EPuckCom
+    results = {}
+    for name, camera in (("com_sensors_pty", False), ("com_sensors_camera_pty", True)):
+        master, slave = os.openpty()
+        tty.setraw(master)
+        tty.setraw(slave)
+        threading.Thread(target=_pty_robot, args=(master, 1600), daemon=True).start()
+        robot = EPuckCom(os.ttyname(slave), timeout=2)
+        robot.connect()
+        robot.enable_sensors = True
+        robot.enable_camera = camera
+        results[name] = measure(robot.data_update, count)
+        robot.close()
+        os.close(slave)
+        os.close(master)
+    return results
+
+
+BENCHMARKS = {
+    "encode": (bench_encode, 20000),
+    "decode": (bench_decode, 20000),
+    "camera": (bench_camera, 500),
+    "ip": (bench_ip_roundtrip, 2000),
+    "com": (bench_com_pty, 500),
+}
+
+def run(names=None, scale=1.0):
+    results = {}
+    for name, (bench, count) in BENCHMARKS.items():
+        if (names and name not in names): continue
+        results.update(bench(max(1, int(count*scale))))
+    return results
+
+#compare results with a baseline, returns the names of benchmarks whose median latency is worse than the tolerance
+# allows. The median is used because it is far less noisy than the mean on a busy machine.
+def compare(results, baseline, tolerance=0.2):
+    regressions = []
+    for name, result in results.items():
+        if (name in baseline and result["p50_us"] > baseline[name]["p50_us"]*(1+tolerance)):
+            regressions.append(name)
+    return regressions
+
+def report(results, baseline=None):
+    print(f"{'benchmark':<30} {'ops/s':>12} {'p50 us':>10} {'p99 us':>10} {'peak alloc':>12} {'vs base':>8}")
+    for name, result in results.items():
+        change = ""
+        if (baseline and name in baseline):
+            change = f"{baseline[name]['p50_us']/result['p50_us']:.2f}x"
+        print(f"{name:<30} {result['ops_per_s']:>12.0f} {result['p50_us']:>10.2f} {result['p99_us']:>10.2f} "
+              f"{result['peak_alloc_bytes']:>12} {change:>8}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="e-puck protocol benchmarks")
+    parser.add_argument("benchmarks", nargs="*", help="subset of "+", ".join(BENCHMARKS))
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply the iteration counts")
+    parser.add_argument("--save", metavar="FILE", help="write the results as a baseline")
+    parser.add_argument("--baseline", metavar="FILE", help="compare with a saved baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed median slowdown before failing")
+    args = parser.parse_args()
+
+    results = run(args.benchmarks, args.scale)
+    baseline = None
+    if (args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    report(results, baseline)
+
+    if (args.save):
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if (baseline):
+        regressions = compare(results, baseline, args.tolerance)
+        if (regressions):
+            print("regressions: "+", ".join(regressions))
+            sys.exit(1)
@@ -0,0 +1,64 @@
+import numpy as np   #pip install numpy. Only needed for decoding camera frames.
+from epuck import epuck
+
+# Vectorized camera frame decoding.
+# Frames arrive as raw bytes: RGB565 is 2 bytes per pixel, most significant byte first, grey is 1 byte per pixel.
+# Decoded frames are written into an output array which is cached and reused, so steady-state streaming
+# does not allocate.
+
+#decode an RGB565 frame into an HxWx3 uint8 array. tmp is an optional HxW uint16 scratch array.
+def decode_rgb565(frame, width, height, out=None, tmp=None):
+    src = np.frombuffer(frame, dtype='>u2', count=width*height).reshape(height, width)
+    if (out is None): out = np.empty((height, width, 3), dtype=np.uint8)
+    if (tmp is None): tmp = np.empty((height, width), dtype=np.uint16)
+
+    #rrrrrggg gggbbbbb -> expand each channel to 8 bits
+    np.right_shift(src, 8, out=tmp)
+    np.bitwise_and(tmp, 0xF8, out=out[..., epuck.R], casting='unsafe')
+    np.right_shift(src, 3, out=tmp)
+    np.bitwise_and(tmp, 0xFC, out=out[..., epuck.G], casting='unsafe')
+    np.left_shift(src, 3, out=tmp)
+    np.bitwise_and(tmp, 0xF8, out=out[..., epuck.B], casting='unsafe')
+    return out
+
+#decode a greyscale frame into an HxW uint8 array
+def decode_grey(frame, width, height, out=None):
+    src = np.frombuffer(frame, dtype=np.uint8, count=width*height).reshape(height, width)
+    if (out is None): return src.copy()
+    np.copyto(out, src)
+    return out
+
+
+class FrameDecoder():
+    #caches output and scratch arrays per frame geometry so repeated decodes reuse the same memory
+
+    def __init__(self):
+        self._out = None
+        self._tmp = None
+
+    #decode a frame. If out is given it is used, otherwise a cached array is reused, so copy the result if you keep it.
+    def decode(self, frame, mode, width, height, out=None):
+        if (frame is None or width <= 0 or height <= 0):
+            return None
+
+        if (mode == epuck.CAM_MODE_RGB565):
+            shape = (height, width, 3)
+            if (self._tmp is None or self._tmp.shape != shape[:2]):
+                self._tmp = np.empty(shape[:2], dtype=np.uint16)
+            if (out is None): out = self._cached_out(shape)
+            return decode_rgb565(frame, width, height, out, self._tmp)
+
+        elif (mode == epuck.CAM_MODE_GREY):
+            if (out is None): out = self._cached_out((height, width))
+            return decode_grey(frame, width, height, out)
+
+        raise ValueError("unknown camera mode "+str(mode))
+
+    #decode the frame currently held in an EPuckState
+    def decode_state(self, state, out=None):
+        return self.decode(state.sens_framebuffer, state.cam_mode, state.cam_width, state.cam_height, out)
+
+    def _cached_out(self, shape):
+        if (self._out is None or self._out.shape != shape):
+            self._out = np.empty(shape, dtype=np.uint8)
+        return self._out
@@ -0,0 +1,110 @@
+from epuck import epuck
+
+# Adapts the camera of an EPuckCom to a target frame rate. Frame read times are measured as frames arrive, the
+# link's cost per byte is estimated from them, and the controller moves along a ladder of camera settings (resolution,
+# colour mode, zoom) to the best one expected to reach the target. The field of view is kept centred on roi_center
+# through the window origin.
+#
+#   robot.camera_controller = CameraController(target_fps=5)
+#   robot.enable_camera = True
+#   ...data_update as usual, robot.state.cam_* follow the controller...
+#
+# Frame times are measured from the frame request, so they are most accurate without pipelining.
+
+#(mode, width, height, zoom) from best to cheapest. Each step keeps roughly the field of view of the one before until
+# the zoom limit of 8, after which the window narrows around roi_center.
+DEFAULT_LADDER = (
+    (epuck.CAM_MODE_RGB565, 160, 120, 4),
+    (epuck.CAM_MODE_GREY, 160, 120, 4),
+    (epuck.CAM_MODE_RGB565, 80, 60, 8),
+    (epuck.CAM_MODE_GREY, 80, 60, 8),
+    (epuck.CAM_MODE_GREY, 40, 30, 8),
+    (epuck.CAM_MODE_GREY, 20, 15, 8),
+)
+
+_SENSOR_SIZE = (640, 480)   #camera sensor pixels
+_FRAME_HEADER = 3           #mode, width, height before each frame
+
+
+def frame_bytes(mode, width, height):
+    return width*height*(2 if mode == epuck.CAM_MODE_RGB565 else 1)
+
+
+class CameraController():
+
+    settle_frames = 5     #frames measured at a setting before it is judged
+    step_up_margin = 1.2  #a better setting must be expected to beat the target by this factor, to avoid oscillating
+    tolerance = 0.9       #the current setting is kept while it reaches this fraction of the target
+
+    #target_fps: frames per second to reach. bytes_per_second: optional cap on camera traffic at that rate.
+    #ladder: settings from best to cheapest, see DEFAULT_LADDER. roi_center: sensor pixel the window is centred on.
+    def __init__(self, target_fps, bytes_per_second=None, ladder=DEFAULT_LADDER, roi_center=(320, 240)):
+        self.target_fps = target_fps
+        self.bytes_per_second = bytes_per_second
+        self.ladder = tuple(ladder)
+        self.roi_center = roi_center
+        self.level = None          #index in the ladder of the setting in use, None until first applied
+        self.frame_time = None     #s per frame at the current setting, smoothed
+        self.changes = 0
+        self._frames = 0           #frames measured at the current level
+        self._pending = 0          #level to apply on the next update, None when nothing to change
+        while (self._pending < len(self.ladder) - 1 and not self._within_budget(self._pending)):
+            self._pending += 1
+
+    #frames per second reached at the current setting, 0 until measured
+    @property
+    def fps(self):
+        return 1.0/self.frame_time if self.frame_time else 0.0
+
+    #called by EPuckCom before each update, applies a pending change
+    def update(self, robot):
+        if (self._pending is None):
+            return
+        level, self._pending = self._pending, None
+        mode, width, height, zoom = self.ladder[level]
+        x, y = self._origin(width, height, zoom)
+        robot.set_camera_parameters(mode, width, height, zoom, x, y)
+        if (robot.state.cam_framebytes == -1):   #not acknowledged, try again next update
+            self._pending = level
+            return
+        self.level = level
+        self.frame_time = None
+        self._frames = 0
+        self.changes += 1
+
+    #called by EPuckCom for every frame read, with its size including the header and the time it took
+    def frame_received(self, robot, size, duration):
+        if (self.level is None):
+            return
+        if (self.frame_time is None):
+            self.frame_time = duration
+        else:
+            self.frame_time += 0.3*(duration - self.frame_time)
+        self._frames += 1
+        if (self._frames < self.settle_frames):
+            return
+
+        cost = self.frame_time/size   #s per byte, including the per frame latency spread over the frame
+        for level, setting in enumerate(self.ladder):
+            if (not self._within_budget(level)):
+                continue
+            size = frame_bytes(*setting[:3])
+            expected_fps = 1.0/(cost*(size + _FRAME_HEADER))
+            required = self.target_fps
+            if (level < self.level): required *= self.step_up_margin
+            elif (level == self.level): required *= self.tolerance
+            if (expected_fps >= required or level == len(self.ladder) - 1):
+                break
+        if (level != self.level):
+            self._pending = level
+
+    def _within_budget(self, level):
+        return (self.bytes_per_second is None or
+                frame_bytes(*self.ladder[level][:3])*self.target_fps <= self.bytes_per_second)
+
+    #window origin on the sensor, keeping the window centred on roi_center and inside the sensor
+    def _origin(self, width, height, zoom):
+        origin = []
+        for center, pixels, sensor in zip(self.roi_center, (width*zoom, height*zoom), _SENSOR_SIZE):
+            origin.append(max(0, min(sensor - pixels, center - pixels//2)))
+        return origin
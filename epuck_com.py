@@ -1,5 +1,7 @@
+import collections
+import time
 from epuck import epuck
-import serial   #pip install pyserial. If you have "serial" installed, it will not work.
+from epuck import epuck_stats
 
 class EPuckCom(epuck.EPuck):
     ### Constants and commands specific to comport communication
@@ -11,20 +13,36 @@ class EPuckCom(epuck.EPuck):
     _CMD_GET_ALL_SENSORS = 0xF8
     _CMD_SET_ALL_ACTUATORS = 0xF7
     _CMD_GET_CAM_FRAME = 0xB7
+    _SENSOR_REQUEST = bytes([_CMD_GET_ALL_SENSORS, 0])   #sensors only, actuators unchanged
+    _CAM_FRAME_REQUEST = bytes([_CMD_GET_CAM_FRAME, 0])   # command ends in null
 
     #ascii mode commands
     _CMD_GET_CAM_PARAMETERS = 'I'
     _CMD_SET_CAM_PARAMETERS = 'J'
 
+    _s_com = None   #serial port, opened on connect
 
-    def __init__(self, port, baud=115200, debug=False, timeout=15):  #timeout in s
+    camera_controller = None   #adjusts the camera parameters each update, see epuck_camera_control
+
+    #pipelined: when True, each update sends the next request before reading the response to the previous one, so
+    # the robot always has a request queued and the link doesn't idle during turnarounds. Data returned by
+    # data_update is then one update old, and actuator commands take effect one update later.
+    def __init__(self, port, baud=115200, debug=False, timeout=15, pipelined=False):  #timeout in s
         super().__init__(debug, timeout)
         self._port = port
         self._baud = baud
+        self._pipelined = pipelined
+        self._in_flight = collections.deque()   #(sensors, camera) of each request awaiting its response
+
+        #preallocated receive buffer, the trailing reserved byte is not sent over com and stays 0
+        self._sensor_buffer = bytearray(epuck._RESPONSE_PACKET_LEN)
+        self._sensor_view = memoryview(self._sensor_buffer)[:epuck._RESPONSE_PACKET_LEN-1]
  
 
     ### COMM methods
     def  _internal_connect(self):
+        import serial   #pip install pyserial. If you have "serial" installed, it will not work. Imported on first use
+        self.close()
         try:
             self._s_com = serial. Serial(self._port, self._baud, timeout=self._timeout)
         except Exception as error:
@@ -34,10 +52,11 @@ class EPuckCom(epuck.EPuck):
         return True
 
     def is_connected(self):
-        return self._s_com.is_open()
+        return self._s_com is not None and self._s_com.is_open
 
     def close(self):
-        self._s_com.close()
+        self._in_flight.clear()   #responses to these will never be read
+        if (self._s_com is not None): self._s_com.close()
 
     def _writeData(self, packet):
         self._s_com.write(packet)
@@ -45,21 +64,31 @@ class EPuckCom(epuck.EPuck):
     def _readData(self, size): #blocking
         return self._s_com.read(size)
 
+    def _readDataInto(self, buffer): #blocking
+        return self._s_com.readinto(buffer)
+
     ### Robot Level Commands
     #set camera parameters: mode(0=grayscale, 1=rgb565), width=[1...640], height=[1...480], zoom=[1,2,4,8], x=[1...640], y=[1...480]
     def set_camera_parameters(self, mode=epuck.CAM_MODE_RGB565, width=40, height=40, zoom=1, x=-1, y=-1):  # note: use of x,y is not clear, I ignore
+        self._drain_requests()   #ascii commands can't be interleaved with binary responses
         if (x==-1): x=width
-        if (y==-1): y=width
+        if (y==-1): y=height
         command_string = f"{self._CMD_SET_CAM_PARAMETERS},{mode},{width},{height},{zoom},{x},{y}\n" 
 
         self._debug_print("setting camera parameters")
         self._writeData(command_string.encode("ascii"))
         self._debug_print("command sent, waiting for response")
-        response = self._readData(self._MAX_READLINE)
-        if (response[0] != ord('j')):
+        response = self._s_com.readline(self._MAX_READLINE)  ##ascii mode, don't wait for a full _readData timeout
+        if (response[:1] != b'j'):
             print("ERR unexpected character returned from ascii command")
+            self.state.cam_framebytes = -1   #unknown, fetched again before the next frame
+            return
+        #the robot acknowledged, so the parameters are known without a get_camera_parameters round trip
+        (self.state.cam_mode, self.state.cam_width, self.state.cam_height, self.state.cam_zoom) = (mode, width, height, zoom)
+        self.state.cam_framebytes = width*height*(2 if mode == epuck.CAM_MODE_RGB565 else 1)
 
     def get_camera_parameters(self):
+        self._drain_requests()
         command_string = self._CMD_GET_CAM_PARAMETERS+"\n"
 
         self._writeData(command_string.encode("ascii"))
@@ -71,44 +100,112 @@ class EPuckCom(epuck.EPuck):
      
     #For COM the command may include a request for data which we should get right away.
     #overload to just do a data update.
-    def send_command(self):
-        self.data_update()
+    def send_command(self, force=False):
+        self._update(force)
                   
     def data_update(self):  #request data and get it
-        super().send_command() # send request for data
-        
-        if (self.enable_sensors):  # above send command already requested sensor data.
+        self._update()
+
+    def _update(self, force=False):
+        if (not self.is_connected()):
+            return
+        if (self.camera_controller is not None and self.enable_camera):
+            self.camera_controller.update(self)   #may change the camera parameters before the next frame request
+        if (self.enable_camera and self.state.cam_framebytes == -1): # camera parameters not yet received
+            self._debug_print("first getting camera parameters")
+            self.get_camera_parameters()
+
+        #sensor and camera requests are sent back to back, then the responses are read in order
+        self._send_request(force)
+        if (self.enable_camera):
+            self._debug_print("sending command to request camera frame")
+            self._timed_write(self._CAM_FRAME_REQUEST)
+        self._in_flight.append((self.enable_sensors, self.enable_camera))
+
+        depth = 2 if self._pipelined else 1
+        while (len(self._in_flight) >= depth):
+            self._receive_update(*self._in_flight.popleft())
+
+    #send the actuator command, or only the sensor request when the command is unchanged or deferred by command_rate
+    def _send_request(self, force=False):
+        if (not super().send_command(force) and self.enable_sensors):
+            self._timed_write(self._SENSOR_REQUEST)
+
+    #poll the robot for a sensor packet, used as heartbeat
+    def _heartbeat(self):
+        self._drain_requests()
+        if (not self.is_connected()):
+            return
+        self._timed_write(self._SENSOR_REQUEST)
+        self._receive_update(True, False)
+
+    #read every outstanding response
+    def _drain_requests(self):
+        while (self._in_flight):
+            self._receive_update(*self._in_flight.popleft())
+
+    #read the responses to one request, in the order they were requested
+    def _receive_update(self, sensors, camera):
+        stats = self.stats
+        if (sensors):
             self._debug_print("waiting for data")
-            response = self._readData(size=epuck._RESPONSE_PACKET_LEN-1) # -1 for reserved byte. seems to not show up on com
-            self._debug_print("response received, "+str(len(response))+" bytes, parsing")
-            response += b'0'  #pad the reserved end byte
-            self._parse_sensors_packet(response)
+            if (stats is not None): start = time.perf_counter()
+            count = self._readDataInto(self._sensor_view) # -1 for reserved byte. seems to not show up on com
+            if (count < len(self._sensor_view)):
+                self._read_timeout()
+                return
+            if (stats is not None): self._record_packet(epuck_stats.PACKET_SENSOR, count, start)
+            self._debug_print("response received, %d bytes, parsing", count)
+            self._parse_sensors_packet(self._sensor_buffer)
+            self._mark_received()
             self._debug_print("parsing complete, update complete")
             
-        if(self.enable_camera):
-            if (self.cam_framebytes == -1): # camera parameters not yet received
-                self._debug_print("first getting camera parameters")
-                self.get_camera_parameters()
-                
-            self.sens_framebuffer = response = self._get_cam_frame()
-
-
+        if (camera):
+            if (stats is not None): start = time.perf_counter()
+            frame = self._read_cam_frame()
+            if (frame is None):
+                return
+            self.state.sens_framebuffer = frame
+            if (stats is not None):
+                self._record_packet(epuck_stats.PACKET_CAMERA, len(self.state.sens_framebuffer) + self._CAM_HEADER_BYTES, start)
+            self._mark_received()
 
     def _get_cam_frame(self):  #sends command to request camera frame and parses repsonse
+        self._drain_requests()
         self._debug_print("sending command to request camera frame")
-        self._writeData(
-            bytearray([
-                self._CMD_GET_CAM_FRAME,
-                0   # command ends in null
-            ])
-        )
+        self._timed_write(self._CAM_FRAME_REQUEST)
+        return self._read_cam_frame()
+
+    def _read_cam_frame(self):
         self._debug_print("command sent, waiting for response")
-        response = self._readData(size=(self.cam_framebytes+self._CAM_HEADER_BYTES))
-        self._debug_print("image received. Mode "+ str(response[0]) + "  width: "+ str(response[1])+ " height: "+str(response[2]))
-        imgarr = response[self._CAM_HEADER_BYTES:]
+        start = time.perf_counter()
+        store = self.frame_store
+        slot = None if store is None else store.acquire(self, self.state.cam_framebytes)
+        if (slot is not None):   #header, then the frame read straight into the store
+            sequence, imgarr = slot
+            response = self._readData(size=self._CAM_HEADER_BYTES)
+            if (len(response) < self._CAM_HEADER_BYTES or self._readDataInto(imgarr) < len(imgarr)):
+                self._read_timeout()
+                return None
+            store.commit(sequence, len(imgarr))
+        else:
+            response = self._readData(size=(self.state.cam_framebytes+self._CAM_HEADER_BYTES))
+            if (len(response) < self.state.cam_framebytes+self._CAM_HEADER_BYTES):
+                self._read_timeout()
+                return None
+            imgarr = response[self._CAM_HEADER_BYTES:]
+        if (self.camera_controller is not None):
+            self.camera_controller.frame_received(self, self._CAM_HEADER_BYTES + len(imgarr), time.perf_counter() - start)
+        self._debug_print("image received. Mode %d  width: %d height: %d", response[0], response[1], response[2])
         self._debug_print("parsing complete, update complete")
         return imgarr
 
+    #a response didn't arrive in time. The rest of it may still come and be taken for the next response, so close
+    # the port and leave it to a reconnect
+    def _read_timeout(self):
+        self._debug_print("timed out waiting for a response, closing")
+        self.close()
+
     ### internal packet packing and unpacking methods
     # protocol taken from https://www.gctronic.com/doc/index.php?title=e-puck2_PC_side_development#WiFi_2
 
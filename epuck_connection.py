@@ -0,0 +1,158 @@
+import threading
+import time
+
+# Connection lifecycle for one robot, over either transport: health checks, heartbeats on idle links, reconnects with
+# exponential backoff and re-sending the stream bits and actuator state once reconnected. Reconnect attempts run on a
+# background thread, so a robot that dropped off the network doesn't stall the control loop.
+#
+#   link = ConnectionManager(EPuckIP("192.168.1.10", timeout=1))
+#   link.add_state_listener(lambda link, old, new: print(link.robot._ip, old, "->", new))
+#   link.connect()
+#   while True:
+#       link.data_update()     #does nothing while the robot is disconnected
+#       ...set link.robot.state actuators...
+#       link.send_command()
+#
+# The robot's timeout still bounds a single stalled read or write, so keep it short (around a second) for robots
+# driven from a shared loop.
+
+#connection states
+DISCONNECTED = "disconnected"
+CONNECTING = "connecting"
+CONNECTED = "connected"
+CLOSED = "closed"
+
+
+class ConnectionManager():
+
+    heartbeat = 0.5         #s without received data before the robot is prompted to send something
+    link_timeout = 2.0      #s without received data before the link is considered lost
+    backoff_initial = 0.1   #s before the first reconnect attempt, doubled after each failed attempt
+    backoff_max = 10.0
+
+    def __init__(self, robot, debug=False):
+        self.robot = robot
+        self.state = DISCONNECTED
+        self.reconnects = 0   #successful reconnects after a lost link
+        self._debug = debug
+        self._state_listeners = []
+        self._attempt = None          #thread running a connect attempt
+        self._attempt_result = False
+        self._backoff = self.backoff_initial
+        self._next_attempt = 0.0      #monotonic time of the next connect attempt
+        self._connected_time = 0.0
+        self._last_heartbeat = 0.0
+        self._was_connected = False
+
+    def _debug_print(self, msg, *args):
+        if(self._debug): print(self.__class__.__name__+": "+(msg % args if args else msg))
+
+    #listener(manager, old_state, new_state) is called on every state change, always from the thread calling
+    # connect / update, never from the reconnect thread
+    def add_state_listener(self, listener):
+        self._state_listeners.append(listener)
+
+    def remove_state_listener(self, listener):
+        self._state_listeners.remove(listener)
+
+    def is_connected(self):
+        return self.state == CONNECTED
+
+    #connect, blocking until the first attempt finishes. Later attempts are made by update. Returns True if connected
+    def connect(self):
+        if (self.state == CLOSED):
+            self._set_state(DISCONNECTED)
+        if (self.state == DISCONNECTED):
+            self._start_attempt()
+        if (self._attempt is not None): self._attempt.join()
+        return self.update()
+
+    def close(self):
+        if (self._attempt is not None):
+            self._attempt.join()
+            self._attempt = None
+        self.robot.close()
+        self._set_state(CLOSED)
+
+    #check the link and drive reconnects, call once per loop. Returns True if the robot is connected
+    def update(self):
+        now = time.monotonic()
+        if (self.state == CONNECTING):
+            if (self._attempt.is_alive()):
+                return False
+            self._attempt.join()
+            self._attempt = None
+            self._finish_attempt(now)
+        elif (self.state == DISCONNECTED):
+            if (now >= self._next_attempt):
+                self._start_attempt()
+            return False
+
+        if (self.state != CONNECTED):
+            return False
+        robot = self.robot
+        if (robot.is_connected()):
+            idle = now - max(robot._rx_time, self._connected_time)
+            if (idle < self.link_timeout):
+                if (idle >= self.heartbeat and now - self._last_heartbeat >= self.heartbeat):
+                    self._last_heartbeat = now
+                    robot._heartbeat()
+                return True
+            self._debug_print("nothing received for %.1fs", idle)
+        self._lost(now)
+        return False
+
+    #update, then the robot's data_update if it is connected. Returns True if the robot is connected
+    def data_update(self):
+        if (not self.update()):
+            return False
+        self.robot.data_update()
+        return True
+
+    #send the robot's actuator state if it is connected. Returns True if the command was written
+    def send_command(self, force=False):
+        if (self.state != CONNECTED or not self.robot.is_connected()):
+            return False
+        return self.robot.send_command(force)
+
+    def _start_attempt(self):
+        self._set_state(CONNECTING)
+        self._attempt = threading.Thread(target=self._connect_robot, name="EPuckConnect", daemon=True)
+        self._attempt.start()
+
+    #runs on the attempt thread, the loop doesn't touch the robot while CONNECTING
+    def _connect_robot(self):
+        try:
+            connected = self.robot.connect()
+            if (connected):
+                self.robot.send_command(force=True)   #re-arm the camera / sensor streams and restore actuators
+            self._attempt_result = connected and self.robot.is_connected()
+        except Exception as error:   #transport errors differ, serial raises its own
+            self._debug_print("connect failed: %s", error)
+            self._attempt_result = False
+
+    def _finish_attempt(self, now):
+        if (self._attempt_result):
+            self._backoff = self.backoff_initial
+            self._connected_time = self._last_heartbeat = now
+            if (self._was_connected): self.reconnects += 1
+            self._was_connected = True
+            self._set_state(CONNECTED)
+        else:
+            self._debug_print("connect failed, retrying in %.1fs", self._backoff)
+            self._next_attempt = now + self._backoff
+            self._backoff = min(self._backoff*2, self.backoff_max)
+            self._set_state(DISCONNECTED)
+
+    def _lost(self, now):
+        self._debug_print("connection lost")
+        self.robot.close()
+        self._next_attempt = now   #retry straight away, backing off only if that fails
+        self._set_state(DISCONNECTED)
+
+    def _set_state(self, state):
+        if (state == self.state):
+            return
+        old, self.state = self.state, state
+        for listener in self._state_listeners:
+            listener(self, old, state)
@@ -0,0 +1,281 @@
+import functools
+import math
+import struct
+import numpy as np   #pip install numpy. Only needed for the filters.
+from epuck.epuck_state import _SENSOR_FIELDS
+
+# Incremental estimators that update as each sensor packet is loaded, so derived values are ready when data_update
+# returns. Each one keeps a row per attached robot in a numpy array, so a whole swarm can be read with one array
+# operation, and updates are done as sensor listeners with a fixed amount of work per packet.
+#
+#   odometry = Odometry(robots)
+#   proximity = EMAFilter("sens_proximity", alpha=0.3, robots=robots)
+#   ...
+#   robot.data_update()
+#   x, y, theta = odometry[robot]
+#   proximity[robot]            #smoothed values of the 8 channels, a copy
+#   proximity.values            #all robots, one row per robot (see row())
+
+_FIELDS = {name: (fmt, count, offset) for name, fmt, count, offset in _SENSOR_FIELDS}
+
+#both step counters, which are adjacent in the packet
+_STEPS = struct.Struct("<HH")
+_STEPS_OFFSET = _FIELDS["sens_left_motor_steps"][2]
+assert _FIELDS["sens_right_motor_steps"][2] == _STEPS_OFFSET + 2
+
+#grow an array along its first axis to hold at least rows rows
+def _grow_rows(array, rows):
+    if (len(array) >= rows):
+        return array
+    grown = np.zeros((max(rows, 2*len(array)),) + array.shape[1:], dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+class _SensorFilter():
+    #one row of state per attached robot, updated by a sensor listener as each packet is loaded. Subclasses implement
+    # _grow(rows), _reset_row(row, robot) and _update(row, robot, packet).
+
+    def __init__(self, robots=()):
+        self._rows = {}   #robot: (row, listener)
+        self._free_rows = []
+        self._row_count = 0
+        for robot in robots:
+            self.attach(robot)
+
+    def __len__(self):
+        return len(self._rows)
+
+    #start updating from robot's sensor packets. Returns the robot's row
+    def attach(self, robot):
+        if (robot in self._rows):
+            return self._rows[robot][0]
+        if (self._free_rows):
+            row = self._free_rows.pop()
+        else:
+            row = self._row_count
+            self._row_count += 1
+            self._grow(self._row_count)
+        self._reset_row(row, robot)
+        listener = functools.partial(self._update, row)
+        robot.add_sensor_listener(listener)
+        self._rows[robot] = (row, listener)
+        return row
+
+    def detach(self, robot):
+        row, listener = self._rows.pop(robot)
+        robot.remove_sensor_listener(listener)
+        self._free_rows.append(row)
+
+    #index of the robot's row in the filter's arrays
+    def row(self, robot):
+        return self._rows[robot][0]
+
+    #the robot's current values, a copy
+    def __getitem__(self, robot):
+        return self._values[self._rows[robot][0]].copy()
+
+    #current values of every row, one per attached robot (see row()). A view, which stops updating once attaching
+    # another robot reallocates the arrays
+    @property
+    def values(self):
+        return self._values[:self._row_count]
+
+    #restart from the next packet, for one robot or all of them
+    def reset(self, robot=None):
+        robots = self._rows if robot is None else (robot,)
+        for robot in robots:
+            self._reset_row(self._rows[robot][0], robot)
+
+
+class Odometry(_SensorFilter):
+    # Differential drive dead reckoning from the wheel step counters. values holds x, y (m) and theta (rad, in
+    # [-pi, pi]) per robot, starting at 0 when attached. The 16 bit counters wrap, so moves are taken as the shortest
+    # difference between packets, which is correct as long as less than 32768 steps (4 m) pass between two packets.
+
+    #e-puck2 geometry: 41 mm wheels, 53 mm between them, 1000 steps per revolution
+    def __init__(self, robots=(), wheel_radius=0.0205, axle_length=0.053, steps_per_revolution=1000):
+        self._step_length = 2*math.pi*wheel_radius/steps_per_revolution
+        self._axle_length = axle_length
+        self._values = np.zeros((0, 3))
+        self._distance = np.zeros(0)
+        self._last_steps = []
+        super().__init__(robots)
+
+    #m travelled by each robot's center
+    @property
+    def distance(self):
+        return self._distance[:self._row_count]
+
+    @property
+    def x(self):
+        return self.values[:, 0]
+
+    @property
+    def y(self):
+        return self.values[:, 1]
+
+    @property
+    def theta(self):
+        return self.values[:, 2]
+
+    #set a robot's pose, for example from an external fix
+    def set_pose(self, robot, x, y, theta):
+        self._values[self._rows[robot][0]] = (x, y, theta)
+
+    def _grow(self, rows):
+        self._values = _grow_rows(self._values, rows)
+        self._distance = _grow_rows(self._distance, rows)
+        self._last_steps.extend([None]*(rows - len(self._last_steps)))
+
+    def _reset_row(self, row, robot):
+        self._values[row] = 0.0
+        self._distance[row] = 0.0
+        self._last_steps[row] = None
+
+    def _update(self, row, robot, packet):
+        left, right = _STEPS.unpack_from(packet, _STEPS_OFFSET)
+        last = self._last_steps[row]
+        self._last_steps[row] = (left, right)
+        if (last is None):   #first packet only sets the reference
+            return
+        left_steps = ((left - last[0] + 0x8000) & 0xFFFF) - 0x8000
+        right_steps = ((right - last[1] + 0x8000) & 0xFFFF) - 0x8000
+        if (left_steps == 0 and right_steps == 0):
+            return
+
+        left_distance = left_steps*self._step_length
+        right_distance = right_steps*self._step_length
+        distance = (left_distance + right_distance)/2
+        turn = (right_distance - left_distance)/self._axle_length
+        pose = self._values[row]
+        x, y, theta = pose.tolist()
+        heading = theta + turn/2   #midpoint of the arc
+        pose[0] = x + distance*math.cos(heading)
+        pose[1] = y + distance*math.sin(heading)
+        pose[2] = math.remainder(theta + turn, 2*math.pi)
+        self._distance[row] += abs(distance)
+
+
+class _FieldFilter(_SensorFilter):
+    #filters one sensor field, all channels at once. values has a row per robot and a column per channel.
+
+    def __init__(self, field, robots=()):
+        if (field not in _FIELDS):
+            raise ValueError("unknown sensor field "+str(field))
+        self._fmt, self._count, self._offset = _FIELDS[field]
+        self.field = field
+        self._values = np.zeros((0, self._count))
+        self._sources = []   #per row, a view of the field in the robot's state
+        super().__init__(robots)
+
+    def _grow(self, rows):
+        self._values = _grow_rows(self._values, rows)
+        self._sources.extend([None]*(rows - len(self._sources)))
+
+    def _reset_row(self, row, robot):
+        self._values[row] = 0.0
+        self._sources[row] = np.frombuffer(robot.state._packet, dtype="="+self._fmt, count=self._count, offset=self._offset)
+
+
+class EMAFilter(_FieldFilter):
+    #exponential moving average, value += alpha*(sample - value). Starts at the first sample.
+
+    def __init__(self, field, alpha=0.2, robots=()):
+        self.alpha = alpha
+        self._primed = []
+        super().__init__(field, robots)
+
+    def _grow(self, rows):
+        super()._grow(rows)
+        self._primed.extend([False]*(rows - len(self._primed)))
+
+    def _reset_row(self, row, robot):
+        super()._reset_row(row, robot)
+        self._primed[row] = False
+
+    def _update(self, row, robot, packet):
+        value = self._values[row]
+        if (self._primed[row]):
+            value += self.alpha*(self._sources[row] - value)
+        else:
+            value[:] = self._sources[row]
+            self._primed[row] = True
+
+
+class _WindowFilter(_FieldFilter):
+    #keeps the last window samples of every channel in a ring
+
+    def __init__(self, field, window, robots=()):
+        self.window = window
+        self._ring = np.zeros((0, window, _FIELDS[field][1]))
+        self._next = []     #per row, the ring slot the next sample goes into
+        self._filled = []   #per row, the samples in the ring, up to window
+        super().__init__(field, robots)
+
+    def _grow(self, rows):
+        super()._grow(rows)
+        self._ring = _grow_rows(self._ring, rows)
+        self._next.extend([0]*(rows - len(self._next)))
+        self._filled.extend([0]*(rows - len(self._filled)))
+
+    def _reset_row(self, row, robot):
+        super()._reset_row(row, robot)
+        self._ring[row] = 0.0
+        self._next[row] = 0
+        self._filled[row] = 0
+
+    #store the new sample in the robot's ring, returns the slot it went into
+    def _push(self, ring, row):
+        slot = self._next[row]
+        ring[slot] = self._sources[row]
+        self._next[row] = (slot + 1) % self.window
+        if (self._filled[row] < self.window): self._filled[row] += 1
+        return slot
+
+
+class RollingMeanFilter(_WindowFilter):
+    #mean of the last window samples, kept as a running sum
+
+    def __init__(self, field, window=10, robots=()):
+        self._sum = np.zeros((0, _FIELDS[field][1]))
+        super().__init__(field, window, robots)
+
+    def _grow(self, rows):
+        super()._grow(rows)
+        self._sum = _grow_rows(self._sum, rows)
+
+    def _reset_row(self, row, robot):
+        super()._reset_row(row, robot)
+        self._sum[row] = 0.0
+
+    def _update(self, row, robot, packet):
+        ring = self._ring[row]
+        total = self._sum[row]
+        total -= ring[self._next[row]]   #the sample about to be replaced, zeros until the ring is full
+        total += ring[self._push(ring, row)]
+        np.divide(total, self._filled[row], out=self._values[row])
+
+
+class MedianFilter(_WindowFilter):
+    #median of the last window samples, removes the single packet spikes of the proximity and ground sensors.
+    # keep the window small (3 to 9), each update sorts it.
+
+    def __init__(self, field, window=5, robots=()):
+        self._sorted = np.zeros((window, _FIELDS[field][1]))   #scratch for sorting a ring
+        super().__init__(field, window, robots)
+
+    def _update(self, row, robot, packet):
+        ring = self._ring[row]
+        self._push(ring, row)
+        filled = self._filled[row]
+        ordered = self._sorted[:filled]
+        ordered[:] = ring[:filled]
+        ordered.sort(axis=0)
+        middle = filled//2
+        value = self._values[row]
+        if (filled % 2):
+            value[:] = ordered[middle]
+        else:
+            np.add(ordered[middle-1], ordered[middle], out=value)
+            value *= 0.5
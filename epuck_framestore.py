@@ -0,0 +1,175 @@
+import bisect
+import collections
+import mmap
+import struct
+import threading
+import time
+
+# Fixed size camera history in a memory-mapped file. Frames are kept in a ring of equal slots with an index record
+# per frame, so minutes of video from many robots take constant RAM: the pages belong to the file and the OS writes
+# them out as needed. Attached robots read their frames straight into the slots (EPuckCom through pyserial's readinto,
+# which still copies internally), and state.sens_framebuffer is then a memoryview of the slot.
+#
+#   store = FrameStore("run1.frames", capacity=3000)
+#   for robot in robots:
+#       store.attach(robot)            #robot ids 0, 1, ... in order of attaching
+#   ...data_update as usual...
+#   store.close()
+#
+#   store = FrameStore("run1.frames")   #reopen for analysis, possibly while still being written
+#   record, frame = store.frame(store.find(time.time() - 10))
+#   for record, frame in store.frames(start, end, robot_id=1):
+#       ...
+#
+# Slots are reused when the ring wraps, so copy a frame to keep it for longer than capacity frames. That includes
+# state.sens_framebuffer of attached robots.
+
+_MAGIC = b"EPUCKFRM"
+_VERSION = 1
+_HEADER = struct.Struct("=8sHII")   #magic, version, capacity, slot bytes
+_NEXT = struct.Struct("=Q")         #sequence of the next frame
+_NEXT_OFFSET = _HEADER.size
+_HEADER_LEN = 64
+_RECORD = struct.Struct("=QdHbHHI")   #sequence, timestamp, robot id, mode, width, height, size (0 until committed)
+_RECORD_LEN = 32
+_SIZE_OFFSET = _RECORD.size - 4
+
+FrameRecord = collections.namedtuple("FrameRecord", "sequence timestamp robot_id mode width height size")
+
+
+class FrameStore():
+
+    #path: file of the store. capacity: frames kept, None to open an existing store.
+    #slot_bytes: largest frame stored, 160x120 RGB565 by default; size it from state.cam_framebytes to save space.
+    def __init__(self, path, capacity=None, slot_bytes=38400):
+        self.path = path
+        self._robots = {}    #robot: robot id
+        self.skipped = 0     #frames not stored because they were larger than slot_bytes
+        if (capacity is not None):
+            with open(path, "wb") as file:
+                file.truncate(self._align(_HEADER_LEN + capacity*_RECORD_LEN) + capacity*slot_bytes)
+        self._file = open(path, "r+b")
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        self._view = memoryview(self._map)
+        magic, version, self.capacity, self.slot_bytes = _HEADER.unpack_from(self._map, 0)
+        if (capacity is not None):
+            self.capacity, self.slot_bytes = capacity, slot_bytes
+            _HEADER.pack_into(self._map, 0, _MAGIC, _VERSION, capacity, slot_bytes)
+        elif (magic != _MAGIC or version != _VERSION):
+            self.close()
+            raise ValueError("not a frame store of this version: "+str(path))
+        self._slots_offset = self._align(_HEADER_LEN + self.capacity*_RECORD_LEN)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _align(offset):
+        return (offset + mmap.PAGESIZE - 1)//mmap.PAGESIZE*mmap.PAGESIZE
+
+    #store the robot's camera frames from now on, under robot_id (the next free id if None). Returns the id
+    def attach(self, robot, robot_id=None):
+        if (robot_id is None):
+            robot_id = max(self._robots.values(), default=-1) + 1
+        self._robots[robot] = robot_id
+        robot.frame_store_id = robot_id
+        robot.frame_store = self
+        return robot_id
+
+    #stop storing the robot's frames. Its current frame is copied out of the store
+    def detach(self, robot):
+        del self._robots[robot]
+        robot.frame_store = None
+        frame = robot.state.sens_framebuffer
+        if (isinstance(frame, memoryview) and frame.obj is self._map):
+            robot.state.sens_framebuffer = bytearray(frame)
+
+    ### writing
+    #reserve the next slot for a frame of size bytes from robot. Returns (sequence, memoryview of the slot) to read the
+    # frame into, then pass sequence to commit. None if the frame doesn't fit in a slot.
+    def acquire(self, robot, size):
+        if (not 0 < size <= self.slot_bytes):
+            self.skipped += 1
+            return None
+        state = robot.state
+        with self._lock:
+            sequence = _NEXT.unpack_from(self._map, _NEXT_OFFSET)[0]
+            _NEXT.pack_into(self._map, _NEXT_OFFSET, sequence + 1)
+            slot = sequence % self.capacity
+            _RECORD.pack_into(self._map, _HEADER_LEN + slot*_RECORD_LEN, sequence, time.time(), robot.frame_store_id,
+                              state.cam_mode, state.cam_width, state.cam_height, 0)
+        start = self._slots_offset + slot*self.slot_bytes
+        return sequence, self._view[start:start+size]
+
+    #mark the frame read into an acquired slot as complete. Frames never committed are skipped by readers
+    def commit(self, sequence, size):
+        struct.pack_into("=I", self._map, _HEADER_LEN + (sequence % self.capacity)*_RECORD_LEN + _SIZE_OFFSET, size)
+
+    #store a copy of frame from robot. Returns its sequence, None if it didn't fit
+    def append(self, robot, frame):
+        slot = self.acquire(robot, len(frame))
+        if (slot is None):
+            return None
+        sequence, view = slot
+        view[:] = frame
+        self.commit(sequence, len(frame))
+        return sequence
+
+    ### reading
+    #sequence numbers of the frames held, oldest first
+    def sequences(self):
+        end = _NEXT.unpack_from(self._map, _NEXT_OFFSET)[0]
+        return range(max(0, end - self.capacity), end)
+
+    def __len__(self):
+        return len(self.sequences())
+
+    #the record of a frame, None if it was overwritten or never committed
+    def record(self, sequence):
+        record = FrameRecord._make(_RECORD.unpack_from(self._map, _HEADER_LEN + (sequence % self.capacity)*_RECORD_LEN))
+        if (record.sequence != sequence or record.size == 0):
+            return None
+        return record
+
+    #(record, memoryview of the frame) by sequence, in constant time. Raises IndexError if the frame is not held.
+    # The view is overwritten when the ring wraps.
+    def frame(self, sequence):
+        record = None if sequence is None else self.record(sequence)
+        if (record is None):
+            raise IndexError("frame "+str(sequence)+" is not in the store")
+        start = self._slots_offset + (sequence % self.capacity)*self.slot_bytes
+        return record, self._view[start:start+record.size]
+
+    #sequence of the last frame received at or before timestamp (time.time()), None if there is none.
+    # Frames are indexed in receive order, so this is a binary search over the index.
+    def find(self, timestamp):
+        sequences = self.sequences()
+        index = bisect.bisect_right(sequences, timestamp, key=self._timestamp)
+        return sequences[index - 1] if index > 0 else None
+
+    def _timestamp(self, sequence):
+        return struct.unpack_from("=d", self._map, _HEADER_LEN + (sequence % self.capacity)*_RECORD_LEN + 8)[0]
+
+    #(record, frame) of the frames received between start and end, optionally from one robot only
+    def frames(self, start=None, end=None, robot_id=None):
+        sequences = self.sequences()
+        if (start is not None):
+            sequences = sequences[bisect.bisect_left(sequences, start, key=self._timestamp):]
+        for sequence in sequences:
+            record = self.record(sequence)
+            if (record is None):
+                continue
+            if (end is not None and record.timestamp > end):
+                break
+            if (robot_id is None or record.robot_id == robot_id):
+                yield self.frame(sequence)
+
+    #detach every robot and close the file. While views of frames are still referenced the mapping stays valid, it is
+    # unmapped once they are freed
+    def close(self):
+        for robot in list(self._robots):
+            self.detach(robot)
+        self._view.release()
+        try:
+            self._map.close()
+        except BufferError:
+            pass
+        self._file.close()
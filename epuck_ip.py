@@ -1,6 +1,9 @@
 import socket
 import select
+import threading
+import time
 from epuck import epuck
+from epuck import epuck_stats
 
 class EPuckIP(epuck.EPuck):
 
@@ -19,45 +22,130 @@ class EPuckIP(epuck.EPuck):
     
     _isOpen = False  # IP doesn't have a clear concept of open/closed. We manage ourself and set to close on failure to push for reconnect
 
-    def __init__(self, ip, port=1000, debug=False, timeout=10): #timeout in s  
+    #latest only draining: when data_update finds several camera frames (or sensor packets) queued, only the newest
+    # is loaded into state. The older ones are read into a reused buffer and counted in frames_dropped / sensors_dropped.
+    # With drop_stale_frames the frame buffer is recycled once a newer frame has been published, copy it to keep it.
+    # With drop_stale_sensors the sensor listeners only see the packets that were loaded.
+    drop_stale_frames = False
+    drop_stale_sensors = False
+
+    #threaded: when True, a background thread continuously drains the socket and data_update only publishes the
+    # newest sensor packet and camera frame into state, without blocking on the network.
+    def __init__(self, ip, port=1000, debug=False, timeout=10, threaded=False): #timeout in s  
         super().__init__(debug, timeout)
         self._port = port
         self._ip = ip 
-        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)   #replaced on every connect
+
+        #preallocated receive buffers, reused for every packet
+        self._header_buffer = bytearray(1)
+        self._header_view = memoryview(self._header_buffer)
+        self._sensor_buffer = bytearray(epuck._RESPONSE_PACKET_LEN)
+        self._sensor_view = memoryview(self._sensor_buffer)
+        self._rx_frame = None   #last camera frame read from the socket
+        self._frame_spare = None   #buffer the next frame is read into when dropping stale frames
+
+        #packet being assembled, read by as many recv calls as it takes
+        self._rx_view = self._header_view   #what is being read: the header, then the body
+        self._rx_offset = 0   #bytes of _rx_view read so far
+        self._rx_signature = None   #header of the packet, None while reading the header
+        self._rx_body = None
+        self._rx_slot = None   #(FrameStore, sequence) the frame is read into
+        self._rx_start = 0.0   #perf_counter when the header arrived, for stats
+
+        #packets read during the current drain but not yet loaded into state, when dropping stale packets
+        self._rx_frame_pending = False
+        self._rx_pending_frame = None   #newest complete frame, loaded by _finish_receive
+        self._rx_sensor_pending = False
+        self._rx_pending_sensor = bytearray(epuck._RESPONSE_PACKET_LEN)   #copy of the newest sensor packet
+        self.frames_dropped = 0
+        self.sensors_dropped = 0
+
+        #threaded receive state, everything below is guarded by _rx_lock
+        self._threaded = threaded
+        self._rx_thread = None
+        self._rx_lock = threading.Lock()
+        self._rx_latest_sensor = bytearray(epuck._RESPONSE_PACKET_LEN)
+        self._rx_latest_frame = None
+        self._rx_sensor_new = False
+        self._rx_frame_new = False
+        self._rx_sequence = 0
+        self._rx_timestamp = 0.0
 
     ### COMM methods
     def  _internal_connect(self):
+        self.close()   #a socket can't be connected again, so every connection gets a new one
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.settimeout(self._timeout)   #bounds connect and any read or write that stalls
         try:
             self._socket.connect( (self._ip, self._port) )
             self._isOpen = True
-        except:
-            #self._socket.settimeout(self._timeout)
+        except OSError as error:
+            self._debug_print("connect failed: %s", error)
             self._isOpen = False
+        if (self._isOpen):
+            self._camera_enabled = self._sensors_enabled = False   #a new connection starts with no streams
+            self._rx_frame_pending = self._rx_sensor_pending = False
+            self._rx_pending_frame = None
+            self._rx_sensor_new = self._rx_frame_new = False
+            self._rx_reset()
+            self.get_camera_parameters()  #frame size must be known before any camera packet arrives
+            if (self._threaded): self._start_receiver()
         return self._isOpen
 
     def is_connected(self):
         return self._isOpen
 
     def close(self):
-        self._socket.close()
         self._isOpen = False
+        if (self._rx_thread is not None):
+            try:
+                self._socket.shutdown(socket.SHUT_RDWR)  #unblock the receiver thread
+            except OSError:
+                pass
+            self._rx_thread.join(self._timeout)
+            self._rx_thread = None
+        self._socket.close()
 
-    def _dataAvailable(self):
-        avail = select.select([self._socket], [], [self._socket], 0)  #poll mode
+    def _dataAvailable(self, timeout=0):
+        if (not self._isOpen):
+            return False
+        avail = select.select([self._socket], [], [self._socket], timeout)  #poll mode by default
         return avail[0] != [] 
 
     def _writeData(self, packet):
-        self._socket.sendall(packet)
+        if (not self._isOpen):
+            return
+        try:
+            self._socket.sendall(packet)
+        except OSError as error:
+            self._debug_print("write failed: %s", error)
+            self._isOpen = False
  
     def _readData(self, size): #blocking
-        data = bytearray()
-        while len(data) < size:
-            newData = self._socket.recv(size-len(data))
-            if (len(newData) == 0):  # empty received data means closed port <-- not true when in non blocking
-                self._isOpen = False
-                return bytearray()
-            data.extend(newData)
+        data = bytearray(size)
+        if (self._readDataInto(data) < size):
+            return bytearray()
         return data
+
+    def _readDataInto(self, buffer): #blocking, fills the whole buffer
+        view = memoryview(buffer)
+        size = len(view)
+        received = 0
+        while received < size:
+            count = self._recvInto(view[received:])
+            if (count == 0):  # empty received data means closed port <-- not true when in non blocking
+                self._isOpen = False
+                return received
+            received += count
+        return received
+
+    def _recvInto(self, buffer): #one recv, blocks only if nothing has arrived. 0 when the connection is lost
+        try:
+            return self._socket.recv_into(buffer)
+        except OSError as error:   #includes the socket timeout, the rest of the packet is not coming
+            self._debug_print("read failed: %s", error)
+            return 0
     
     ### Robot Level Commands   
     def set_camera_parameters(self, mode=epuck.CAM_MODE_RGB565, width=160, height=120, zoom=1):  
@@ -70,10 +158,14 @@ class EPuckIP(epuck.EPuck):
 
     #override to fix IP protocol bug - If you start a song, the song will repeat the first note if you don't immediately send
     # a new packate with no song.
-    def send_command(self):
+    def send_command(self, force=False):
         song_command = not (self.state.act_speaker_sound == epuck.SOUND_NOCHANGE or self.state.act_speaker_sound == epuck.SOUND_STOP)
-        super().send_command()
-        if (song_command): super().send_command()  #send again. it's automatically reset to no change by the super
+        sent = super().send_command(force)
+        if (sent and song_command): super().send_command(force=True)  #send again. it's automatically reset to no change by the super
+        return sent
+
+    def _write_command(self, packet):
+        super()._write_command(packet)
         self._camera_enabled = self.enable_camera # remember our set state
         self._sensors_enabled = self.enable_sensors
       
@@ -85,28 +177,206 @@ class EPuckIP(epuck.EPuck):
           
     #request and update data on all active systems
     def data_update(self):
-        
-        if  ( (self.enable_camera != self._camera_enabled) or   #ensure requested streams match what user wants
+        self._sync_streams()
+
+        if (self._rx_thread is not None):
+            self._publish_received()
+            return
+
+        while (self._dataAvailable()):
+            if (not self._receive_packet()):
+                break
+        self._finish_receive()
+
+    #ensure requested streams match what user wants
+    def _sync_streams(self):
+        if  ( (self.enable_camera != self._camera_enabled) or
             (self.enable_sensors != self._sensors_enabled) ):
-            self.send_command()
+            self.send_command(force=True)
+        else:
+            self.flush_command()
             
+        if (self.enable_camera and self.state.cam_framebytes == -1): # camera parameters not yet known
+            self.get_camera_parameters()
+
+    #read one packet and load it into state. Returns False if the connection was lost
+    def _receive_packet(self):
+        return self._load_packet(self._read_packet())
+
+    #load a packet read into the receive buffers into state. Returns False if the connection was lost
+    def _load_packet(self, signature):
+        match signature:
+            case None:
+                return False
+
+            case self._CMD_CAMERA_PACKET:
+                if (self.drop_stale_frames):
+                    if (self._rx_frame_pending):
+                        self.frames_dropped += 1
+                        self._frame_spare = self._rx_pending_frame   #replaced, its buffer takes the next frame
+                    self._rx_frame_pending = True
+                    self._rx_pending_frame = self._rx_frame
+                else:
+                    self.state.sens_framebuffer = self._rx_frame
+                    self._mark_received()
+            
+            case self._CMD_SENSOR_PACKET:
+                if (self.drop_stale_sensors):
+                    if (self._rx_sensor_pending): self.sensors_dropped += 1
+                    self._rx_sensor_pending = True
+                    self._rx_pending_sensor[:] = self._sensor_buffer   #the next packet is read into the buffer
+                else:
+                    self._parse_sensors_packet(self._sensor_buffer)
+                    self._mark_received()
+        return True
+
+    #load the newest packets held back while draining into state
+    def _finish_receive(self):
+        if (self._rx_sensor_pending):
+            self._rx_sensor_pending = False
+            self._parse_sensors_packet(self._rx_pending_sensor)
+            self._mark_received()
+        if (self._rx_frame_pending):
+            self._rx_frame_pending = False
+            self._frame_spare = self.state.sens_framebuffer   #recycle the frame this one replaces
+            self.state.sens_framebuffer = self._rx_pending_frame
+            self._rx_pending_frame = None
+            self._mark_received()
     
-        while (self._dataAvailable()):
-            data = self._readData(1)  #get command byte
-            match data[0]:
-                case self._CMD_CAMERA_PACKET:
-                    response = self._readData(self.cam_framebytes)
-                    self.sens_framebuffer = response
-                
-                case self._CMD_SENSOR_PACKET:
-                    response = self._readData(epuck._RESPONSE_PACKET_LEN)
-                    self._parse_sensors_packet(response)
-                
-                case self._CMD_EMPTY_PACKET:
-                    pass
-                
-                case _:
-                    self._debug_print("unexpected packet signature "+str(data[0]))
+    #read one packet into the receive buffers. Returns the packet signature, or None if the connection was lost
+    def _read_packet(self):
+        while (True):
+            signature = self._read_step()
+            if (signature is not False):
+                return signature
+
+    #read one packet in the swarm and load it into state once complete. Called when select reports data, so
+    # it makes a single recv and never blocks on a slow robot. Returns False if the connection was lost
+    def _receive_step(self):
+        signature = self._read_step()
+        if (signature is False):
+            return True
+        return self._load_packet(signature)
+
+    #one recv towards the packet being assembled. Returns its signature once complete, False while incomplete,
+    # None if the connection was lost
+    def _read_step(self):
+        view = self._rx_view
+        count = self._recvInto(view[self._rx_offset:])
+        if (count == 0):
+            self._isOpen = False
+            self._rx_reset()
+            return None
+        self._rx_offset += count
+        if (self._rx_offset < len(view)):
+            return False
+
+        self._rx_offset = 0
+        if (self._rx_signature is None):   #header complete, the body follows
+            self._rx_signature = view[0]
+            self._rx_time = time.monotonic()
+            if (self.stats is not None): self._rx_start = time.perf_counter()
+            body = self._rx_body = self._begin_body(view[0])
+            if (body is not None and len(body) > 0):
+                self._rx_view = memoryview(body)
+                return False
+        signature = self._rx_signature
+        self._rx_reset()
+        self._end_body(signature)
+        return signature
+
+    #wait for the header of the next packet
+    def _rx_reset(self):
+        self._rx_view = self._header_view
+        self._rx_offset = 0
+        self._rx_signature = None
+
+    #the buffer the body of a packet is read into, None if it has none
+    def _begin_body(self, signature):
+        match signature:
+            case self._CMD_CAMERA_PACKET:
+                store = self.frame_store
+                slot = None if store is None else store.acquire(self, self.state.cam_framebytes)
+                if (slot is not None):   #read straight into the store
+                    self._rx_slot = (store, slot[0])
+                    return slot[1]
+                frame = self._frame_spare if self.drop_stale_frames else None
+                self._frame_spare = None   #never read two frames into one buffer, a short read would tear the other
+                if (type(frame) is not bytearray or len(frame) != self.state.cam_framebytes):   #not a store slot
+                    frame = bytearray(self.state.cam_framebytes)
+                return frame
+
+            case self._CMD_SENSOR_PACKET:
+                return self._sensor_view
+        return None
+
+    def _end_body(self, signature):
+        stats = self.stats
+        match signature:
+            case self._CMD_CAMERA_PACKET:
+                frame = self._rx_body
+                if (self._rx_slot is not None):
+                    store, sequence = self._rx_slot
+                    store.commit(sequence, len(frame))
+                    self._rx_slot = None
+                self._rx_frame = frame
+                if (stats is not None): self._record_packet(epuck_stats.PACKET_CAMERA, 1 + len(frame), self._rx_start)
+
+            case self._CMD_SENSOR_PACKET:
+                if (stats is not None): self._record_packet(epuck_stats.PACKET_SENSOR, 1 + epuck._RESPONSE_PACKET_LEN, self._rx_start)
+
+            case self._CMD_EMPTY_PACKET:
+                if (stats is not None): self._record_packet(epuck_stats.PACKET_EMPTY, 1, self._rx_start)
+
+            case _:
+                self._debug_print("unexpected packet signature %d", signature)
+                if (stats is not None): self._record_packet(epuck_stats.PACKET_UNEXPECTED, 1, self._rx_start)
+
+    ### threaded receive
+    def _start_receiver(self):
+        self._rx_thread = threading.Thread(target=self._receiver_loop, name="EPuckIP-"+str(self._ip), daemon=True)
+        self._rx_thread.start()
+
+    #runs on the receiver thread: drain the socket and keep only the newest sensor packet and frame
+    def _receiver_loop(self):
+        try:
+            while (self._isOpen):
+                if (not self._dataAvailable(self._timeout)):   #idle, don't let the socket timeout close the link
+                    continue
+                match self._read_packet():
+                    case None:
+                        break
+
+                    case self._CMD_CAMERA_PACKET:
+                        with self._rx_lock:
+                            if (self._rx_frame_new): self.frames_dropped += 1
+                            self._rx_latest_frame = self._rx_frame
+                            self._rx_frame_new = True
+                            self._rx_sequence += 1
+                            self._rx_timestamp = time.time()
+
+                    case self._CMD_SENSOR_PACKET:
+                        with self._rx_lock:
+                            if (self._rx_sensor_new): self.sensors_dropped += 1
+                            self._rx_latest_sensor[:] = self._sensor_buffer
+                            self._rx_sensor_new = True
+                            self._rx_sequence += 1
+                            self._rx_timestamp = time.time()
+        except OSError as error:
+            self._debug_print("receiver stopped: "+str(error))
+        self._isOpen = False
+
+    #copy the newest data from the receiver thread into state, as one consistent snapshot
+    def _publish_received(self):
+        with self._rx_lock:
+            if (self._rx_sensor_new):
+                self._parse_sensors_packet(self._rx_latest_sensor)
+                self._rx_sensor_new = False
+            if (self._rx_frame_new):
+                self.state.sens_framebuffer = self._rx_latest_frame
+                self._rx_frame_new = False
+            self.state.rx_sequence = self._rx_sequence
+            self.state.rx_timestamp = self._rx_timestamp
     
     
     ### internal packet packing and unpacking methods
@@ -125,4 +395,4 @@ class EPuckIP(epuck.EPuck):
         ])
         command.extend(command_core)
         return command
-    
\ No newline at end of file
+    
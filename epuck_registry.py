@@ -0,0 +1,116 @@
+import importlib
+
+# Opens robots from URIs. Transport modules are imported the first time their scheme is used, so importing the package
+# stays fast and doesn't need pyserial or numpy.
+#
+#   robot = open_epuck("tcp://192.168.1.5:1000")
+#   robot = open_epuck("serial:///dev/rfcomm0?baud=115200&pipelined=1")
+#   robot = open_epuck("serial:COM3")
+#   robot = open_epuck("replay:captures/run1.cap?speed=0")
+#   robot = open_epuck("sim://?rate=100&latency=0.005")      #a local EPuckSimulator robot, for tests
+#   robot = open_epuck("async+tcp://192.168.1.5")            #not connected, await robot.connect()
+#
+# Query parameters become keyword arguments of the transport's constructor; keyword arguments given to open_epuck
+# override them. Other transports are added with register_transport.
+
+#scheme: (factory or "module:attribute" to import on first use, whether open_epuck connects it)
+_TRANSPORTS = {}
+
+#factory(location, options) returns an unconnected robot. location is the URI split by urllib.parse.urlsplit and
+# options the keyword arguments. factory may be given as "module:attribute", imported when the scheme is first opened.
+# connect=False for transports that can't be connected synchronously, like the asyncio ones.
+def register_transport(scheme, factory, connect=True):
+    _TRANSPORTS[scheme.lower()] = (factory, connect)
+
+def transports():
+    return sorted(_TRANSPORTS)
+
+#create the robot for uri and connect it unless connect is False. Raises ValueError for an unknown scheme and
+# ConnectionError if connecting fails.
+def open_epuck(uri, connect=True, **options):
+    from urllib.parse import urlsplit, parse_qsl
+    location = urlsplit(uri)
+    scheme = location.scheme.lower()
+    if (scheme not in _TRANSPORTS):
+        raise ValueError("unknown e-puck transport "+repr(scheme)+" in "+repr(uri)+", known: "+", ".join(transports()))
+    factory, connects = _TRANSPORTS[scheme]
+    if (isinstance(factory, str)):
+        module, attribute = factory.split(":")
+        factory = getattr(importlib.import_module(module), attribute)
+        _TRANSPORTS[scheme] = (factory, connects)
+
+    query = {name: _convert(name, value) for name, value in parse_qsl(location.query)}
+    robot = factory(location, {**query, **options})
+    if (connect and connects and not robot.connect()):
+        raise ConnectionError("could not connect to "+uri)
+    return robot
+
+
+### query parameter conversion
+def _flag(value):
+    return value.lower() in ("1", "true", "yes", "on")
+
+def _speed(value):   #replay speed, "none" or 0 for as fast as possible
+    return None if value.lower() in ("none", "0") else float(value)
+
+_OPTION_TYPES = {
+    "timeout": float, "debug": _flag,
+    "threaded": _flag,                      #tcp
+    "baud": int, "pipelined": _flag,        #serial
+    "speed": _speed,                        #replay
+    "rate": float, "camera_rate": float, "latency": float, "bandwidth": float, "fragment": int,   #sim
+}
+
+def _convert(name, value):
+    convert = _OPTION_TYPES.get(name)
+    return value if convert is None else convert(value)
+
+#the part of a URI naming a device or file: serial:///dev/ttyUSB0, serial:COM3 and replay:run.cap all work
+def _path(location):
+    return location.netloc + location.path
+
+
+### built in transports
+def _open_tcp(location, options):
+    from epuck.epuck_ip import EPuckIP
+    return EPuckIP(location.hostname, location.port or 1000, **options)
+
+def _open_serial(location, options):
+    from epuck.epuck_com import EPuckCom
+    return EPuckCom(_path(location), **options)
+
+def _open_replay(location, options):
+    from epuck.epuck_replay import EPuckReplay
+    return EPuckReplay(_path(location), **options)
+
+def _open_replay_serial(location, options):
+    from epuck.epuck_replay import EPuckComReplay
+    return EPuckComReplay(_path(location), **options)
+
+def _open_async_tcp(location, options):
+    from epuck.epuck_async import AsyncEPuckIP
+    return AsyncEPuckIP(location.hostname, location.port or 1000, **options)
+
+def _open_async_serial(location, options):
+    from epuck.epuck_async import AsyncEPuckCom
+    return AsyncEPuckCom(_path(location), **options)
+
+#one simulated robot served from a background thread, kept as robot.simulator
+def _open_sim(location, options):
+    from epuck.epuck_ip import EPuckIP
+    from epuck.epuck_simulator import EPuckSimulator
+    sim_options = {name: options.pop(name) for name in ("rate", "camera_rate", "latency", "bandwidth", "fragment")
+                   if name in options}
+    simulator = EPuckSimulator(1, location.hostname or "127.0.0.1", location.port or 0, **sim_options)
+    simulator.start()
+    robot = EPuckIP(location.hostname or "127.0.0.1", simulator.ports[0], **options)
+    robot.simulator = simulator
+    return robot
+
+register_transport("tcp", _open_tcp)
+register_transport("serial", _open_serial)
+register_transport("replay", _open_replay)
+register_transport("replay+serial", _open_replay_serial)
+register_transport("async+tcp", _open_async_tcp, connect=False)
+register_transport("async+serial", _open_async_serial, connect=False)
+register_transport("sim", _open_sim)
@@ -0,0 +1,223 @@
+import struct
+import time
+from epuck.epuck_ip import EPuckIP
+from epuck.epuck_com import EPuckCom
+
+# Capture and replay of the raw byte stream received from a robot, so the parsing and control pipeline can be run,
+# tested and benchmarked without hardware.
+#
+#   capture = StreamCapture("run1.cap")
+#   robot.connect()
+#   capture.attach(robot)           #records everything the robot's socket / serial port receives
+#   ...
+#   capture.close()
+#
+#   robot = EPuckReplay("run1.cap", speed=None)   #as fast as possible, or 1.0 for original timing, 10.0 for 10x
+#   robot.connect()
+#   robot.enable_sensors = True
+#   while robot.is_connected(): robot.data_update()
+#
+# EPuckComReplay does the same for a stream captured from EPuckCom; written requests are ignored and reads are served
+# from the capture in order.
+
+_MAGIC = b"EPUCKCAP"
+_VERSION = 1
+_HEADER = struct.Struct("<8sH")
+_CHUNK = struct.Struct("<dI")   #receive time, length
+
+
+#load a capture file as a list of (timestamp, bytes) chunks
+def load_capture(path):
+    chunks = []
+    with open(path, "rb") as capture:
+        magic, version = _HEADER.unpack(capture.read(_HEADER.size))
+        if (magic != _MAGIC):
+            raise ValueError(str(path)+" is not an e-puck stream capture")
+        while (True):
+            header = capture.read(_CHUNK.size)
+            if (len(header) < _CHUNK.size): break
+            timestamp, length = _CHUNK.unpack(header)
+            chunks.append((timestamp, capture.read(length)))
+    return chunks
+
+
+class StreamCapture():
+
+    def __init__(self, path):
+        self._file = open(path, "wb")
+        self._file.write(_HEADER.pack(_MAGIC, _VERSION))
+
+    #record everything the robot receives from now on. Call after connect.
+    def attach(self, robot):
+        if (isinstance(robot, EPuckIP)):
+            robot._socket = _CaptureProxy(robot._socket, self)
+        else:
+            robot._s_com = _CaptureProxy(robot._s_com, self)
+
+    def append(self, data, timestamp=None):
+        if (len(data) == 0): return
+        self._file.write(_CHUNK.pack(time.time() if timestamp is None else timestamp, len(data)))
+        self._file.write(data)
+
+    def close(self):
+        self._file.close()
+
+
+class _CaptureProxy():
+    #wraps a socket or serial port, recording received bytes and passing everything else through
+
+    def __init__(self, inner, capture):
+        self._inner = inner
+        self._capture = capture
+
+    def __getattr__(self, name):
+        return getattr(self._inner, name)
+
+    def recv_into(self, buffer, *args):
+        count = self._inner.recv_into(buffer, *args)
+        self._capture.append(memoryview(buffer)[:count])
+        return count
+
+    def readinto(self, buffer):
+        count = self._inner.readinto(buffer)
+        self._capture.append(memoryview(buffer)[:count])
+        return count
+
+    def read(self, size=1):
+        data = self._inner.read(size)
+        self._capture.append(data)
+        return data
+
+    def readline(self, size=-1):
+        data = self._inner.readline(size)
+        self._capture.append(data)
+        return data
+
+
+class _ReplayStream():
+    #serves captured chunks in order. speed scales the original timing, None replays as fast as possible
+
+    def __init__(self, chunks, speed):
+        self._chunks = chunks
+        self._speed = speed
+        self._index = 0
+        self._position = 0     #read position within the current chunk
+        self._start = 0.0
+        self._origin = chunks[0][0] if chunks else 0.0
+        self.written = 0       #bytes the library tried to send
+
+    def start(self):
+        self._start = time.perf_counter()
+
+    def finished(self):
+        return self._index >= len(self._chunks)
+
+    #True if the next chunk is due
+    def available(self):
+        if (self.finished()): return False
+        return self._speed is None or self._due(self._index) <= time.perf_counter()
+
+    #blocking read filling buffer, returns fewer bytes only at the end of the stream
+    def read_into(self, buffer):
+        view = memoryview(buffer)
+        size = len(view)
+        received = 0
+        while (received < size and not self.finished()):
+            self._wait(self._index)
+            chunk = self._chunks[self._index][1]
+            count = min(size - received, len(chunk) - self._position)
+            view[received:received+count] = chunk[self._position:self._position+count]
+            received += count
+            self._position += count
+            if (self._position == len(chunk)):
+                self._index += 1
+                self._position = 0
+        return received
+
+    def readline(self, size):
+        line = bytearray()
+        byte = bytearray(1)
+        while (len(line) < size and not line.endswith(b'\n') and self.read_into(byte) == 1):
+            line.extend(byte)
+        return bytes(line)
+
+    def _due(self, index):
+        return self._start + (self._chunks[index][0] - self._origin)/self._speed
+
+    def _wait(self, index):
+        if (self._speed is None): return
+        delay = self._due(index) - time.perf_counter()
+        if (delay > 0): time.sleep(delay)
+
+
+class EPuckReplay(EPuckIP):
+    # EPuckIP that reads a captured WiFi stream instead of a socket
+
+    def __init__(self, capture, speed=1.0, debug=False):  #capture is a file path or a list of (timestamp, bytes)
+        super().__init__("replay", debug=debug)
+        self._socket.close()   #never used
+        self._stream = _ReplayStream(load_capture(capture) if isinstance(capture, str) else capture, speed)
+
+    ### COMM methods
+    def _internal_connect(self):
+        self._isOpen = not self._stream.finished()
+        self.get_camera_parameters()
+        self._stream.start()
+        return self._isOpen
+
+    def is_connected(self):
+        return self._isOpen and not self._stream.finished()
+
+    def close(self):
+        self._isOpen = False
+
+    def _dataAvailable(self):
+        return self._stream.available()
+
+    def _writeData(self, packet):
+        self._stream.written += len(packet)
+
+    def _recvInto(self, buffer):   #0 at the end of the capture, which closes the connection
+        return self._stream.read_into(buffer)
+
+
+class _ReplaySerial():
+    #stands in for a pyserial port
+
+    def __init__(self, stream):
+        self._stream = stream
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+
+    def write(self, data):
+        self._stream.written += len(data)
+
+    def read(self, size=1):
+        data = bytearray(size)
+        return bytes(data[:self._stream.read_into(data)])
+
+    def readinto(self, buffer):
+        return self._stream.read_into(buffer)
+
+    def readline(self, size=-1):
+        return self._stream.readline(size if size > 0 else 1 << 16)
+
+
+class EPuckComReplay(EPuckCom):
+    # EPuckCom that reads a captured serial stream instead of a port
+
+    def __init__(self, capture, speed=1.0, debug=False):  #capture is a file path or a list of (timestamp, bytes)
+        super().__init__("replay", debug=debug)
+        self._stream = _ReplayStream(load_capture(capture) if isinstance(capture, str) else capture, speed)
+        self._s_com = None
+
+    ### COMM methods
+    def _internal_connect(self):
+        self._s_com = _ReplaySerial(self._stream)
+        self._stream.start()
+        return True
+
+    def is_connected(self):
+        return self._s_com is not None and self._s_com.is_open and not self._stream.finished()
@@ -0,0 +1,144 @@
+import time
+from epuck.epuck_stats import Histogram
+
+# Fixed rate control loop for one or many robots. Ticks start on absolute deadlines (start + n*period), so timing
+# errors don't accumulate the way they do with a sleep at the end of each loop. Every tick runs
+#   data_update on every robot -> control(loop) -> send_command on every robot -> vision(loop)
+# and the vision phase is skipped when what is left of the period is too short for it, so that the control phases
+# keep their timing under overload.
+#
+#   def control(loop):
+#       for robot in loop.robots:
+#           robot.state.act_left_motor_speed = ...
+#
+#   loop = ControlLoop(robots, rate=50, control=control, vision=process_frames)
+#   loop.run(duration=60)
+#   print(loop)
+#
+# robots may also be an EPuckSwarm, which is then updated and sent to as a whole, or ConnectionManager instances.
+
+PHASES = ("update", "control", "send", "vision")
+
+
+class ControlLoop():
+
+    spin = 0.0005   #s before a deadline when sleeping stops and the loop busy waits, for sub-ms tick starts
+
+    #robots: a robot, a list of robots or an EPuckSwarm. rate in Hz.
+    #control(loop) and vision(loop) are called every tick, vision only when there is time left for it.
+    def __init__(self, robots, rate=50, control=None, vision=None):
+        if (hasattr(robots, "send_commands")):   #swarm
+            self.robots = robots
+            self._updates = (robots.data_update,)
+            self._sends = (robots.send_commands,)
+        else:
+            self.robots = list(robots) if isinstance(robots, (list, tuple)) else [robots]
+            self._updates = tuple(robot.data_update for robot in self.robots)
+            self._sends = tuple(robot.send_command for robot in self.robots)
+        self.period = 1.0/rate
+        self.control = control
+        self.vision = vision
+        self.phases = {phase: Histogram() for phase in PHASES}   #duration of each phase in s
+        self.tick_time = Histogram()   #duration of whole ticks
+        self.jitter = Histogram()      #how late each tick started
+        self._running = False
+        self.reset_stats()
+
+    def reset_stats(self):
+        for histogram in self.phases.values():
+            histogram.reset()
+        self.tick_time.reset()
+        self.jitter.reset()
+        self.ticks = 0
+        self.missed = 0           #ticks that ran past the next deadline, the deadlines they covered are skipped
+        self.vision_skipped = 0
+        self._vision_estimate = 0.0   #expected vision duration, from recent runs
+
+    #seconds since run started, on the deadline of the current tick
+    @property
+    def time(self):
+        return self._deadline - self._start
+
+    #run ticks until stop is called, or for duration s or count ticks
+    def run(self, duration=None, count=None):
+        self._running = True
+        self._start = time.perf_counter()
+        self._deadline = self._start
+        end = None if duration is None else self._start + duration
+        ticks = 0
+        while (self._running and (count is None or ticks < count)):
+            self._wait(self._deadline)
+            if (end is not None and self._deadline >= end):
+                break
+            self.jitter.record(time.perf_counter() - self._deadline)
+            self._tick()
+            ticks += 1
+
+            #next deadline, skipping those already passed
+            self._deadline += self.period
+            now = time.perf_counter()
+            if (now > self._deadline):
+                behind = int((now - self._deadline)/self.period) + 1
+                self.missed += 1
+                self._deadline += behind*self.period
+        self._running = False
+
+    #stop after the current tick, from a callback or another thread
+    def stop(self):
+        self._running = False
+
+    def _tick(self):
+        phases = self.phases
+        start = time.perf_counter()
+        for update in self._updates:
+            update()
+        now = time.perf_counter()
+        phases["update"].record(now - start)
+
+        if (self.control is not None):
+            self.control(self)
+            then, now = now, time.perf_counter()
+            phases["control"].record(now - then)
+
+        for send in self._sends:
+            send()
+        then, now = now, time.perf_counter()
+        phases["send"].record(now - then)
+
+        if (self.vision is not None):
+            if (self._deadline + self.period - now > self._vision_estimate):
+                self.vision(self)
+                then, now = now, time.perf_counter()
+                phases["vision"].record(now - then)
+                self._vision_estimate += 0.2*(now - then - self._vision_estimate)
+            else:
+                self.vision_skipped += 1
+                self._vision_estimate *= 0.9   #retried once the estimate has decayed, in case the load has passed
+
+        self.tick_time.record(now - start)
+        self.ticks += 1
+
+    def _wait(self, deadline):
+        remaining = deadline - time.perf_counter()
+        if (remaining > self.spin):
+            time.sleep(remaining - self.spin)
+        while (time.perf_counter() < deadline):
+            pass
+
+    def summary(self):
+        return {
+            "ticks": self.ticks,
+            "missed": self.missed,
+            "vision_skipped": self.vision_skipped,
+            "jitter": self.jitter.summary(),
+            "tick": self.tick_time.summary(),
+            "phases": {phase: histogram.summary() for phase, histogram in self.phases.items()},
+        }
+
+    def __str__(self):
+        lines = [f"{self.ticks} ticks at {1/self.period:g} Hz, {self.missed} missed, vision skipped {self.vision_skipped}",
+                 f"  jitter  {self.jitter}",
+                 f"  tick    {self.tick_time}"]
+        for phase, histogram in self.phases.items():
+            lines.append(f"  {phase:<7} {histogram}")
+        return "\n".join(lines)
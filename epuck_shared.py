@@ -0,0 +1,236 @@
+import os
+import struct
+import time
+from multiprocessing import resource_tracker, shared_memory
+from epuck.epuck_state import EPuckState, _SENSORS_PACKET_LEN, BINARY_LED_COUNT, RGB_LED_COUNT
+
+# Publishes a robot's state to other local processes through shared memory, so a logger, a dashboard and a planner
+# can all follow one robot without another connection or any extra traffic on the link.
+# The owner of the connection publishes after each update. Subscribers read without locking: every block is guarded
+# by a sequence counter that is odd while it is being written, and readers retry until they copy a block whose
+# counter was even and unchanged around the copy (a seqlock). Subscribers can also post actuator intents, which the
+# owner merges into the robot's state before sending its command.
+#
+#   owner:                                          other process:
+#   publisher = StatePublisher(robot, "robot1")     subscriber = StateSubscriber("robot1", intent_slot=0)
+#   while True:                                     state = subscriber.read()
+#       robot.data_update()                         frame = subscriber.read_frame()
+#       publisher.publish()                         subscriber.submit(left=200, right=200)
+#       ...
+#       publisher.apply_intents()
+#       robot.send_command()
+#
+# Each intent slot must have a single writing process. Blocks are copied with single memcpy calls, whose ordering
+# the seqlock relies on; this holds on x86 and is the common case elsewhere, but is not guaranteed by Python.
+
+_MAGIC = b"EPUCKSHM"
+_VERSION = 2
+_HEADER = struct.Struct("=8sHHIIQ")   #magic, version, intent slots, sensor packet length, frame capacity, tracker id
+_HEADER_LEN = 64
+_SEQ = struct.Struct("=Q")
+_META = struct.Struct("=Qdiiiiii")    #rx_sequence, rx_timestamp, cam mode/width/height/zoom/framebytes, frame size
+_META_OFFSET = _HEADER_LEN + _SEQ.size
+_PACKET_OFFSET = _META_OFFSET + _META.size
+_FRAME_OFFSET = (_PACKET_OFFSET + _SENSORS_PACKET_LEN + 63)//64*64
+
+#which fields of an intent are set
+INTENT_MOTORS = 0x01
+INTENT_LEDS = 0x02
+INTENT_RGB = 0x04
+INTENT_SOUND = 0x08
+
+_INTENT = struct.Struct("=Idhh"+str(BINARY_LED_COUNT)+"?"+str(3*RGB_LED_COUNT)+"BB")  #mask, time, speeds, leds, rgb, sound
+_INTENT_LEN = 64
+
+def _intents_offset(frame_capacity):
+    return (_FRAME_OFFSET + frame_capacity + 63)//64*64
+
+#identifies this process' resource tracker: the inode of the pipe to it, which child processes inherit. 0 where
+# shared memory isn't tracked
+def _tracker_id():
+    if (os.name != "posix"):
+        return 0
+    return os.fstat(resource_tracker.getfd()).st_ino
+
+#attach to an existing segment without leaving it registered with this process' resource tracker, which would remove
+# it when the process exits. Before python 3.13 attaching always registers. If the tracker is the publisher's (a child
+# process) that only repeats the publisher's registration, which must stay; otherwise it is undone.
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        pass
+    memory = shared_memory.SharedMemory(name=name)
+    if (_HEADER.unpack_from(memory.buf, 0)[-1] != _tracker_id()):
+        resource_tracker.unregister(memory._name, "shared_memory")
+    return memory
+
+
+class StatePublisher():
+
+    #name: segment name subscribers attach with. frame_capacity: largest camera frame published, 0 for sensors only.
+    def __init__(self, robot, name, frame_capacity=38400, intent_slots=8):
+        self.robot = robot
+        self.name = name
+        self._frame_capacity = frame_capacity
+        self._intent_slots = intent_slots
+        size = _intents_offset(frame_capacity) + intent_slots*_INTENT_LEN
+        self._memory = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self._buffer = self._memory.buf
+        _HEADER.pack_into(self._buffer, 0, _MAGIC, _VERSION, intent_slots, _SENSORS_PACKET_LEN, frame_capacity,
+                          _tracker_id())
+        self._seq = 0
+        self._published_sequence = None   #rx_sequence last published
+        self._published_frame = None
+        self._intent_seqs = [0]*intent_slots   #sequence of the last intent applied from each slot
+
+    #copy the robot's state into the segment if anything was received since the last call. Returns True if it did
+    def publish(self):
+        state = self.robot.state
+        if (state.rx_sequence == self._published_sequence):
+            return False
+        self._published_sequence = state.rx_sequence
+        frame = state.sens_framebuffer
+        new_frame = (self._frame_capacity > 0 and frame is not None and frame is not self._published_frame and
+                     len(frame) <= self._frame_capacity)
+        buffer = self._buffer
+
+        self._seq += 1   #odd, readers wait
+        _SEQ.pack_into(buffer, _HEADER_LEN, self._seq)
+        if (new_frame):
+            self._published_frame = frame
+            buffer[_FRAME_OFFSET:_FRAME_OFFSET+len(frame)] = frame
+        frame_size = len(self._published_frame) if self._published_frame is not None else 0
+        _META.pack_into(buffer, _META_OFFSET, state.rx_sequence, state.rx_timestamp, state.cam_mode, state.cam_width,
+                        state.cam_height, state.cam_zoom, state.cam_framebytes, frame_size)
+        buffer[_PACKET_OFFSET:_PACKET_OFFSET+_SENSORS_PACKET_LEN] = state._packet
+        self._seq += 1
+        _SEQ.pack_into(buffer, _HEADER_LEN, self._seq)
+        return True
+
+    #merge intents posted since the last call into the robot's actuator state, oldest first.
+    # Returns the number applied.
+    def apply_intents(self):
+        intents = []
+        buffer = self._buffer
+        offset = _intents_offset(self._frame_capacity)
+        for slot in range(self._intent_slots):
+            start = offset + slot*_INTENT_LEN
+            seq = _SEQ.unpack_from(buffer, start)[0]
+            if (seq == self._intent_seqs[slot] or seq & 1):
+                continue
+            intent = _INTENT.unpack_from(buffer, start + _SEQ.size)
+            if (_SEQ.unpack_from(buffer, start)[0] != seq):   #rewritten while read, picked up next call
+                continue
+            self._intent_seqs[slot] = seq
+            intents.append(intent)
+
+        state = self.robot.state
+        for intent in sorted(intents, key=lambda intent: intent[1]):
+            mask, timestamp, left, right = intent[:4]
+            leds = intent[4:4+BINARY_LED_COUNT]
+            rgb = intent[4+BINARY_LED_COUNT:4+BINARY_LED_COUNT+3*RGB_LED_COUNT]
+            if (mask & INTENT_MOTORS):
+                state.act_left_motor_speed, state.act_right_motor_speed = left, right
+            if (mask & INTENT_LEDS):
+                state.act_binary_led_states = list(leds)
+            if (mask & INTENT_RGB):
+                state.act_rgb_led_colors = [tuple(rgb[i:i+3]) for i in range(0, len(rgb), 3)]
+            if (mask & INTENT_SOUND):
+                state.act_speaker_sound = intent[-1]
+        return len(intents)
+
+    #release the segment. Subscribers that are still attached keep their mapping but see no more updates
+    def close(self):
+        self._buffer = None
+        self._published_frame = None
+        self._memory.close()
+        self._memory.unlink()
+
+
+class StateSubscriber():
+
+    retry_sleep = 0.0   #s between read attempts while the publisher writes, 0 just yields
+
+    #intent_slot: index of the intent slot this process writes, None for read only
+    def __init__(self, name, intent_slot=None):
+        self._memory = _attach(name)
+        self._buffer = self._memory.buf
+        magic, version, intent_slots, packet_len, frame_capacity, tracker = _HEADER.unpack_from(self._buffer, 0)
+        if (magic != _MAGIC or version != _VERSION or packet_len != _SENSORS_PACKET_LEN):
+            self._memory.close()
+            raise ValueError("not an e-puck state segment of this version: "+name)
+        if (intent_slot is not None and not 0 <= intent_slot < intent_slots):
+            self._memory.close()
+            raise ValueError("intent slot "+str(intent_slot)+" out of range, the segment has "+str(intent_slots))
+        self._frame_capacity = frame_capacity
+        self._intent_offset = None
+        if (intent_slot is not None):
+            self._intent_offset = _intents_offset(frame_capacity) + intent_slot*_INTENT_LEN
+            self._intent_seq = _SEQ.unpack_from(self._buffer, self._intent_offset)[0]
+
+    #sequence of the published state, changes with every publish. Cheap to poll for new data
+    @property
+    def sequence(self):
+        return _SEQ.unpack_from(self._buffer, _HEADER_LEN)[0]
+
+    #copy the latest published sensor state into state (a new EPuckState if None) and return it
+    def read(self, state=None):
+        if (state is None): state = EPuckState()
+        buffer = self._buffer
+        while (True):
+            seq = _SEQ.unpack_from(buffer, _HEADER_LEN)[0]
+            if (not seq & 1):
+                meta = _META.unpack_from(buffer, _META_OFFSET)
+                state._packet_view[:] = buffer[_PACKET_OFFSET:_PACKET_OFFSET+_SENSORS_PACKET_LEN]
+                if (_SEQ.unpack_from(buffer, _HEADER_LEN)[0] == seq):
+                    break
+            time.sleep(self.retry_sleep)
+        (state.rx_sequence, state.rx_timestamp, state.cam_mode, state.cam_width, state.cam_height, state.cam_zoom,
+         state.cam_framebytes) = meta[:7]
+        return state
+
+    #copy the latest published camera frame into out (a new bytearray if None or of the wrong size) and return it,
+    # None if no frame was published
+    def read_frame(self, out=None):
+        buffer = self._buffer
+        while (True):
+            seq = _SEQ.unpack_from(buffer, _HEADER_LEN)[0]
+            if (not seq & 1):
+                size = _META.unpack_from(buffer, _META_OFFSET)[-1]
+                if (size == 0):
+                    return None
+                if (out is None or len(out) != size): out = bytearray(size)
+                out[:] = buffer[_FRAME_OFFSET:_FRAME_OFFSET+size]
+                if (_SEQ.unpack_from(buffer, _HEADER_LEN)[0] == seq):
+                    return out
+            time.sleep(self.retry_sleep)
+
+    #post an actuator intent, merged by the owner before its next command. Fields left as None are not changed.
+    # left and right motor speeds go together, leds: BINARY_LED_COUNT booleans, rgb: RGB_LED_COUNT (r, g, b) tuples
+    def submit(self, left=None, right=None, leds=None, rgb=None, sound=None):
+        if (self._intent_offset is None):
+            raise ValueError("subscriber has no intent slot")
+        mask = 0
+        if ((left is None) != (right is None)):
+            raise ValueError("left and right motor speeds must be given together")
+        if (left is not None): mask |= INTENT_MOTORS
+        if (leds is not None): mask |= INTENT_LEDS
+        else: leds = [False]*BINARY_LED_COUNT
+        if (rgb is not None): mask |= INTENT_RGB
+        else: rgb = [(0,0,0)]*RGB_LED_COUNT
+        if (sound is not None): mask |= INTENT_SOUND
+        else: sound = 0
+        colors = [value for color in rgb for value in color]
+
+        buffer = self._buffer
+        self._intent_seq += 1
+        _SEQ.pack_into(buffer, self._intent_offset, self._intent_seq)
+        _INTENT.pack_into(buffer, self._intent_offset + _SEQ.size, mask, time.time(), left or 0, right or 0, *leds,
+                          *colors, sound)
+        self._intent_seq += 1
+        _SEQ.pack_into(buffer, self._intent_offset, self._intent_seq)
+
+    def close(self):
+        self._buffer = None
+        self._memory.close()
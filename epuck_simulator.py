@@ -0,0 +1,297 @@
+import argparse
+import collections
+import math
+import selectors
+import socket
+import struct
+import threading
+import time
+from epuck import epuck
+from epuck.epuck_ip import EPuckIP
+from epuck.epuck_state import _SENSORS_STRUCT
+
+# Local simulator of the e-puck2 WiFi protocol, for load testing EPuckIP without robots.
+# Every simulated robot listens on its own port. A connected client sends EPuckIP command packets; the stream bits
+# select which packets are then sent back at the configured rate, with synthetic sensor data and camera frames.
+# All robots are served from one thread and one selector, so hundreds can run on localhost.
+#
+#   sim = EPuckSimulator(count=100, rate=100, latency=0.005, fragment=512)
+#   sim.start()
+#   robots = [EPuckIP("127.0.0.1", port) for port in sim.ports]
+#   ...
+#   sim.stop()
+#
+# or from a shell:  python -m epuck.epuck_simulator --robots 100 --port 10000
+
+_COMMAND_PACKET_LEN = 21   #header, request, 19 bytes of actuator command
+_CAMERA_FRAME_BYTES = 38400   #QQVGA RGB565, the only format available over WiFi
+
+class _SimulatedRobot():
+    #one listening port and, once a client connects, its stream state
+
+    def __init__(self, sim, index, listener):
+        self.index = index
+        self.listener = listener
+        self.port = listener.getsockname()[1]
+        self.client = None
+        self._sim = sim
+        self._received = bytearray()
+        self._outgoing = collections.deque()   #[release time, data, bytes already sent]
+        self._backlog = 0   #bytes in _outgoing
+        self.dropped = 0    #packets not queued because the backlog was full
+        self._tokens = 0.0
+        self._tokens_time = 0.0
+        self.camera = False
+        self.sensors = False
+        self.left_speed = 0
+        self.right_speed = 0
+        self._left_steps = 0.0
+        self._right_steps = 0.0
+        self._tick = 0
+        self.next_sensor = 0.0
+        self.next_camera = 0.0
+
+    def accept(self, client):
+        if (self.client is not None): self.disconnect()
+        client.setblocking(False)
+        client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)   #keep fragment boundaries on the wire
+        self.client = client
+        self._received.clear()
+        self._outgoing.clear()
+        self._backlog = 0
+        self.camera = self.sensors = False
+        self._tokens_time = time.perf_counter()
+
+    def disconnect(self):
+        self._sim._unregister(self.client)
+        self.client.close()
+        self.client = None
+
+    #consume received bytes, parsing complete command packets
+    def receive(self, data, now):
+        self._received.extend(data)
+        while (len(self._received) >= _COMMAND_PACKET_LEN):
+            if (self._received[0] != EPuckIP._CMD_COMMAND_PACKET):
+                del self._received[0]   #resynchronise on the next command header
+                continue
+            self._command(self._received[:_COMMAND_PACKET_LEN], now)
+            del self._received[:_COMMAND_PACKET_LEN]
+
+    def _command(self, packet, now):
+        request = packet[1]
+        camera = bool(request & EPuckIP._CMD_CAMERA_STREAM_BIT)
+        sensors = bool(request & EPuckIP._CMD_SENSORS_STREAM_BIT)
+        if (sensors and not self.sensors): self.next_sensor = now
+        if (camera and not self.camera): self.next_camera = now
+        self.camera, self.sensors = camera, sensors
+        self.left_speed, self.right_speed = struct.unpack_from("<hh", packet, 3)
+        if (not (camera or sensors)):
+            self.queue(bytes([EPuckIP._CMD_EMPTY_PACKET]), now)
+
+    #generate packets that are due. Returns the time the next one is due
+    def generate(self, now):
+        period = self._sim.period
+        while (self.sensors and self.next_sensor <= now):
+            self.queue(self._sensor_packet(period), now)
+            self.next_sensor += period
+        while (self.camera and self.next_camera <= now):
+            self.queue(self._sim.camera_packet, now)
+            self.next_camera += self._sim.camera_period
+        due = math.inf
+        if (self.sensors): due = self.next_sensor
+        if (self.camera): due = min(due, self.next_camera)
+        return due
+
+    #a packet that would take the backlog over max_backlog is dropped, like a robot whose client stopped reading
+    def queue(self, data, now):
+        limit = self._sim.max_backlog
+        if (limit is not None and self._backlog + len(data) > limit):
+            self.dropped += 1
+            return
+        self._outgoing.append([now + self._sim.latency, data, 0])
+        self._backlog += len(data)
+
+    #send what is released, within the bandwidth budget and fragment size. Returns the time more can be sent
+    def flush(self, now):
+        sim = self._sim
+        if (sim.bandwidth is not None):
+            self._tokens = min(sim.bandwidth*sim.burst, self._tokens + (now - self._tokens_time)*sim.bandwidth)
+            self._tokens_time = now
+        while (self._outgoing and self._outgoing[0][0] <= now):
+            entry = self._outgoing[0]
+            release, data, sent = entry
+            size = len(data) - sent
+            if (sim.fragment is not None): size = min(size, sim.fragment)
+            if (sim.bandwidth is not None):
+                if (self._tokens < 1): return now + (1 - self._tokens)/sim.bandwidth
+                size = min(size, int(self._tokens))
+            try:
+                count = self.client.send(memoryview(data)[sent:sent+size])
+            except BlockingIOError:
+                return now + sim.poll_interval
+            entry[2] += count
+            if (sim.bandwidth is not None): self._tokens -= count
+            if (entry[2] == len(data)):
+                self._outgoing.popleft()
+                self._backlog -= len(data)
+            if (sim.fragment is not None): return now   #one fragment per pass so packets arrive split
+        return self._outgoing[0][0] if self._outgoing else math.inf
+
+    def _sensor_packet(self, period):
+        self._tick += 1
+        t = self._tick*period
+        self._left_steps += self.left_speed*period
+        self._right_steps += self.right_speed*period
+        proximity = [int(2000 + 1500*math.sin(t + i)) for i in range(epuck.SENS_PROXIMITY_COUNT)]
+        packet = bytearray(1 + _SENSORS_STRUCT.size)
+        packet[0] = EPuckIP._CMD_SENSOR_PACKET
+        _SENSORS_STRUCT.pack_into(packet, 1,
+            0, 0, 2048,                             #accelerometer
+            1.0, (t*10) % 360, 0.0,                 #acceleration, orientation, inclination
+            0, 0, 0,                                #gyro
+            0.0, 0.0, 0.0,                          #magnetometer
+            25,                                     #temperature
+            *proximity,
+            *[100]*epuck.SENS_AMBIENT_COUNT,
+            100 + (self._tick % 200),               #tof
+            *[self._tick % 256]*epuck.SENS_MIC_COUNT,
+            int(self._left_steps) & 0xFFFF, int(self._right_steps) & 0xFFFF,
+            3700,                                   #battery
+            False,                                  #SD
+            self.index % 16,                        #selector
+            *[500]*epuck.SENS_GROUND_PROX_COUNT,
+            *[100]*epuck.SENS_GROUND_AMB_COUNT,
+            False,                                  #button
+            0)
+        return packet
+
+
+class EPuckSimulator():
+
+    poll_interval = 0.001   #s, retry interval when a client socket is full
+    burst = 0.05            #s of bandwidth that may be sent back to back
+    max_backlog = 1 << 20   #bytes queued per robot before new packets are dropped, None for no limit
+
+    #count: number of robots, each on its own port starting at base_port (0 picks free ports)
+    #rate: sensor packets per second, camera_rate: frames per second
+    #latency: delay added to every packet in s, bandwidth: bytes/s cap per robot (None for unlimited)
+    #fragment: maximum bytes per socket write, to exercise packet reassembly (None to send whole packets)
+    def __init__(self, count=1, host="127.0.0.1", base_port=0, rate=100, camera_rate=10, latency=0.0, bandwidth=None,
+                 fragment=None, debug=False):
+        self._debug = debug
+        self.period = 1.0/rate
+        self.camera_period = 1.0/camera_rate
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.fragment = fragment
+        self._selector = selectors.DefaultSelector()
+        self._thread = None
+        self._running = False
+
+        frame = bytearray(_CAMERA_FRAME_BYTES)
+        for i in range(0, _CAMERA_FRAME_BYTES, 2):   #RGB565 gradient
+            pixel = (i//2) % 160
+            frame[i] = (pixel >> 3) << 3
+            frame[i+1] = (pixel >> 2) & 0x1F
+        self.camera_packet = bytes([EPuckIP._CMD_CAMERA_PACKET]) + frame
+
+        self.robots = []
+        for index in range(count):
+            listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            listener.bind((host, base_port + index if base_port else 0))
+            listener.listen(1)
+            listener.setblocking(False)
+            robot = _SimulatedRobot(self, index, listener)
+            self._selector.register(listener, selectors.EVENT_READ, robot)
+            self.robots.append(robot)
+
+    @property
+    def ports(self):
+        return [robot.port for robot in self.robots]
+
+    #packets dropped by all robots because their backlog was full
+    @property
+    def dropped(self):
+        return sum(robot.dropped for robot in self.robots)
+
+    def _debug_print(self, msg):
+        if(self._debug): print(self.__class__.__name__+": "+msg)
+
+    #serve from a background thread
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self.serve_forever, name="EPuckSimulator", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if (self._thread is not None):
+            self._thread.join()
+            self._thread = None
+        for robot in self.robots:
+            if (robot.client is not None): robot.disconnect()
+            self._unregister(robot.listener)
+            robot.listener.close()
+
+    def serve_forever(self):
+        self._running = True
+        due = 0.0
+        while (self._running):
+            timeout = min(max(0.0, due - time.perf_counter()), 0.1)
+            for key, mask in self._selector.select(timeout):
+                robot = key.data
+                if (key.fileobj is robot.listener):
+                    client, address = robot.listener.accept()
+                    self._debug_print("robot "+str(robot.index)+" connected from "+str(address))
+                    if (robot.client is not None): self._unregister(robot.client)
+                    robot.accept(client)
+                    self._selector.register(client, selectors.EVENT_READ, robot)
+                    continue
+                try:
+                    data = robot.client.recv(4096)
+                except (BlockingIOError, InterruptedError):
+                    continue
+                except OSError:
+                    data = b''
+                if (not data):
+                    self._debug_print("robot "+str(robot.index)+" disconnected")
+                    robot.disconnect()
+                    continue
+                robot.receive(data, time.perf_counter())
+
+            now = time.perf_counter()
+            due = now + 0.1
+            for robot in self.robots:
+                if (robot.client is None): continue
+                try:
+                    due = min(due, robot.generate(now), robot.flush(now))
+                except OSError:
+                    robot.disconnect()
+
+    def _unregister(self, sock):
+        try:
+            self._selector.unregister(sock)
+        except (KeyError, ValueError):
+            pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="e-puck2 WiFi protocol simulator")
+    parser.add_argument("--robots", type=int, default=1)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1000, help="port of the first robot, the others follow")
+    parser.add_argument("--rate", type=float, default=100, help="sensor packets per second")
+    parser.add_argument("--camera-rate", type=float, default=10, help="camera frames per second")
+    parser.add_argument("--latency", type=float, default=0.0, help="s")
+    parser.add_argument("--bandwidth", type=float, default=None, help="bytes per second per robot")
+    parser.add_argument("--fragment", type=int, default=None, help="maximum bytes per write")
+    args = parser.parse_args()
+
+    sim = EPuckSimulator(args.robots, args.host, args.port, args.rate, args.camera_rate, args.latency, args.bandwidth,
+                         args.fragment, debug=True)
+    print("simulating "+str(args.robots)+" robots on ports "+str(sim.ports[0])+"-"+str(sim.ports[-1]))
+    try:
+        sim.serve_forever()
+    except KeyboardInterrupt:
+        pass
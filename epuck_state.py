@@ -1,3 +1,6 @@
+import struct
+import sys
+
 
 #constants for readibility sanity
 R = X = 0
@@ -48,46 +51,141 @@ SENS_GROUND_RIGHT = 2
  SENS_PROX_L_45,
  SENS_PROX_L_10) = range(SENS_PROXIMITY_COUNT)
 
+#wire layout of the sensor packet: (field name, struct format, count). None marks bytes that are not exposed.
+# fields with a count of 1 are plain values, the others are typed views into the state's packet buffer.
+_SENSOR_LAYOUT = (
+    ("sens_accelerometer", "h", 3),     #accelerometer axes X Y Z
+    ("sens_acceleration", "f", 1),      #acceleration, orientation, inclination
+    ("sens_orientation", "f", 1),
+    ("sens_inclination", "f", 1),
+    ("sens_gyro", "h", 3),              #gyro X Y Z axis values
+    ("sens_magnetometer", "f", 3),      #magnetometer X Y Z axes
+    ("sens_temperature", "B", 1),       #Temperature in c
+    ("sens_proximity", "H", SENS_PROXIMITY_COUNT),  #proximity sensors
+    ("sens_ambient", "H", SENS_AMBIENT_COUNT),      #ambient light sensors
+    ("sens_tof_distance_mm", "H", 1),   #tof
+    ("sens_mic_volume", "H", SENS_MIC_COUNT),       #microphones
+    ("sens_left_motor_steps", "H", 1),  #motors L/R
+    ("sens_right_motor_steps", "H", 1),
+    ("sens_battery_mv", "H", 1),        #battery level
+    ("sens_has_SD", "?", 1),            #SD present
+    (None, "x", 3),                     # Rc5 TV protocol, ignored
+    ("sens_selector_pos", "B", 1),      #selector
+    ("sens_ground_prox", "H", SENS_GROUND_PROX_COUNT),  #ground proximity
+    ("sens_ground_amp", "H", SENS_GROUND_AMB_COUNT),    #ground ambient
+    ("sens_button_press", "?", 1),      #button
+    (None, "B", 1),                     #reserved
+)
+
+#(name, format, count, byte offset) of every exposed field
+_SENSOR_FIELDS = []
+_offset = 0
+for _name, _fmt, _count in _SENSOR_LAYOUT:
+    if (_name is not None): _SENSOR_FIELDS.append((_name, _fmt, _count, _offset))
+    _offset += struct.calcsize("<"+str(_count)+_fmt)
+_SENSORS_PACKET_LEN = _offset
+del _name, _fmt, _count, _offset
+
+_SENSOR_VECTORS = tuple(name for name, fmt, count, offset in _SENSOR_FIELDS if count > 1)
+
+#epuck is little endian. On a little endian host the buffer holds the packet as received, otherwise it is kept in
+# native order and converted when loaded.
+_SENSORS_STRUCT = struct.Struct("<"+"".join(str(count)+fmt for name, fmt, count in _SENSOR_LAYOUT))
+_NATIVE_STRUCT = struct.Struct("="+"".join(str(count)+fmt for name, fmt, count in _SENSOR_LAYOUT))
+_NATIVE_IS_WIRE = (sys.byteorder == "little")
+
+
+class _SensorValue():
+    #named accessor for a single value stored in the state's packet buffer
+    __slots__ = ("_struct", "_offset")
+
+    def __init__(self, fmt, offset):
+        self._struct = struct.Struct("="+fmt)
+        self._offset = offset
+
+    def __get__(self, state, owner=None):
+        if (state is None): return self
+        return self._struct.unpack_from(state._packet, self._offset)[0]
+
+    def __set__(self, state, value):
+        self._struct.pack_into(state._packet, self._offset, value)
+
+
 class EPuckState():
+    # Per robot state. Sensor values live in one buffer laid out like the wire protocol: vector fields such as
+    # sens_proximity are typed memoryviews into it and scalar fields are read from it on access, so loading a packet
+    # or taking a snapshot is a single copy.
 
-    #actuators to set
-    act_left_motor_speed = 0  # -1000..1000, steps / second?
-    act_right_motor_speed = 0
-    act_binary_led_states = [False]*BINARY_LED_COUNT
-    act_rgb_led_colors = [ (0,0,0) ]*RGB_LED_COUNT
-    act_speaker_sound = SOUND_STOP
-    
-    ## things to read
-    sens_framebuffer = None
-    sens_accelerometer = [0, 0, 0]  #X Y Z
-    sens_acceleration = 0
-    sens_orientation = 0
-    sens_inclination = 0
-    sens_gyro = [0, 0, 0] #X Y Z
-    sens_magnetometer = [0, 0, 0] #X Y Z
-    sens_temperature = 0
-    sens_proximity = [0]*SENS_PROXIMITY_COUNT
-    sens_ambient = [0]*SENS_AMBIENT_COUNT
-    sens_tof_distance_mm = 0
-    sens_mic_volume = [0]*SENS_MIC_COUNT
-    sens_left_motor_steps = 0
-    sens_right_motor_steps = 0
-    sens_battery_mv = 0
-    sens_has_SD = False
-    sens_selector_pos = 0
-    sens_ground_prox = [0]*SENS_GROUND_AMB_COUNT
-    sens_ground_amp = [0]*SENS_GROUND_AMB_COUNT
-    sens_button_press = False
-
-    #camera parameters loaded from robot/library
-    cam_mode = -1
-    cam_width = -1
-    cam_height = -1
-    cam_zoom = -1
-    cam_framebytes = -1
-
-    def __init__(self): 
-        pass
+    __slots__ = ("_packet", "_packet_view") + _SENSOR_VECTORS + (
+        #actuators to set
+        "act_left_motor_speed",     # -1000..1000, steps / second?
+        "act_right_motor_speed",
+        "act_binary_led_states",
+        "act_rgb_led_colors",
+        "act_speaker_sound",
+
+        ## things to read that are not part of the sensor packet
+        "sens_framebuffer",
+
+        #camera parameters loaded from robot/library
+        "cam_mode",
+        "cam_width",
+        "cam_height",
+        "cam_zoom",
+        "cam_framebytes",
+
+        #receive bookkeeping, updated by the library with each sensor or camera packet
+        "rx_sequence",      #count of packets received
+        "rx_timestamp",     #time.time() the newest packet was received
+    )
+
+    def __init__(self, packet=None):
+        self._init_packet()
+
+        self.act_left_motor_speed = 0
+        self.act_right_motor_speed = 0
+        self.act_binary_led_states = [False]*BINARY_LED_COUNT
+        self.act_rgb_led_colors = [ (0,0,0) ]*RGB_LED_COUNT
+        self.act_speaker_sound = SOUND_STOP
+
+        self.sens_framebuffer = None
+
+        self.cam_mode = -1
+        self.cam_width = -1
+        self.cam_height = -1
+        self.cam_zoom = -1
+        self.cam_framebytes = -1
+
+        self.rx_sequence = 0
+        self.rx_timestamp = 0.0
+
+        if (packet is not None): self.load_packet(packet)
+
+    #the packet buffer and the vector field views into it
+    def _init_packet(self):
+        self._packet = bytearray(_SENSORS_PACKET_LEN)
+        self._packet_view = memoryview(self._packet)
+        for name, fmt, count, offset in _SENSOR_FIELDS:
+            if (count > 1):
+                setattr(self, name, self._packet_view[offset:offset+struct.calcsize(str(count)+fmt)].cast(fmt))
+
+    #pickle and deepcopy: memoryviews can't be pickled, so the packet travels as a snapshot and the views are rebuilt
+    def __getstate__(self):
+        frame = self.sens_framebuffer
+        if (isinstance(frame, memoryview)): frame = bytes(frame)   #e.g. a frame store slot
+        return (self.snapshot(), self.act_left_motor_speed, self.act_right_motor_speed, list(self.act_binary_led_states),
+                list(self.act_rgb_led_colors), self.act_speaker_sound, frame, self.cam_mode, self.cam_width,
+                self.cam_height, self.cam_zoom, self.cam_framebytes, self.rx_sequence, self.rx_timestamp)
+
+    def __setstate__(self, state):
+        self._init_packet()
+        self.load_packet(state[0])
+        (self.act_left_motor_speed, self.act_right_motor_speed, self.act_binary_led_states, self.act_rgb_led_colors,
+         self.act_speaker_sound, self.sens_framebuffer, self.cam_mode, self.cam_width, self.cam_height, self.cam_zoom,
+         self.cam_framebytes, self.rx_sequence, self.rx_timestamp) = state[1:]
+
+    def __copy__(self):
+        return self.copy()
 
     def __str__(self):
         ##column widths for auto alignment
@@ -133,23 +231,40 @@ class EPuckState():
         self.act_rgb_led_colors = [ (0,0,0) ]*RGB_LED_COUNT
         self.act_speaker_sound = SOUND_STOP
 
+    #load a raw sensor packet (bytes-like, little endian as sent by the robot)
+    def load_packet(self, packet):
+        if (_NATIVE_IS_WIRE):
+            if (len(packet) != _SENSORS_PACKET_LEN): packet = memoryview(packet)[:_SENSORS_PACKET_LEN]
+            self._packet_view[:] = packet
+        else:
+            _NATIVE_STRUCT.pack_into(self._packet, 0, *_SENSORS_STRUCT.unpack_from(packet))
 
     def load_data(self, data):   # load data from a tuple representing all the sensors, in order of the com protocol, into variables. 
-            self.sens_accelerometer[X], self.sens_accelerometer[Y], self.sens_accelerometer[Z], \
-            self.sens_acceleration, self.sens_orientation, self.sens_inclination, \
-            self.sens_gyro[X], self.sens_gyro[Y], self.sens_gyro[Z], \
-            self.sens_magnetometer[X], self.sens_magnetometer[Y], self.sens_magnetometer[Z], \
-            self.sens_temperature, \
-            self.sens_proximity[0], self.sens_proximity[1], self.sens_proximity[2], self.sens_proximity[3], \
-            self.sens_proximity[4], self.sens_proximity[5], self.sens_proximity[6], self.sens_proximity[7], \
-            self.sens_ambient[0], self.sens_ambient[1], self.sens_ambient[2], self.sens_ambient[3], \
-            self.sens_ambient[4], self.sens_ambient[5], self.sens_ambient[6], self.sens_ambient[7], \
-            self.sens_tof_distance_mm, \
-            self.sens_mic_volume[0], self.sens_mic_volume[1], self.sens_mic_volume[2], self.sens_mic_volume[3], \
-            self.sens_left_motor_steps, self.sens_right_motor_steps, \
-            self.sens_battery_mv, \
-            self.sens_has_SD, \
-            self.sens_selector_pos, \
-            self.sens_ground_prox[0], self.sens_ground_prox[1], self.sens_ground_prox[2], \
-            self.sens_ground_amp[0], self.sens_ground_amp[1], self.sens_ground_amp[2], \
-            self.sens_button_press, dummy = data
\ No newline at end of file
+        _NATIVE_STRUCT.pack_into(self._packet, 0, *data)
+
+    #the sensor state as a raw packet, in the robot's byte order
+    def snapshot(self):
+        if (_NATIVE_IS_WIRE):
+            return bytes(self._packet)
+        return _SENSORS_STRUCT.pack(*_NATIVE_STRUCT.unpack_from(self._packet))
+
+    #independent copy of this state
+    def copy(self):
+        other = EPuckState()
+        other._packet_view[:] = self._packet_view
+        other.act_left_motor_speed = self.act_left_motor_speed
+        other.act_right_motor_speed = self.act_right_motor_speed
+        other.act_binary_led_states = list(self.act_binary_led_states)
+        other.act_rgb_led_colors = list(self.act_rgb_led_colors)
+        other.act_speaker_sound = self.act_speaker_sound
+        other.sens_framebuffer = self.sens_framebuffer
+        other.cam_mode, other.cam_width, other.cam_height, other.cam_zoom, other.cam_framebytes = \
+            self.cam_mode, self.cam_width, self.cam_height, self.cam_zoom, self.cam_framebytes
+        other.rx_sequence = self.rx_sequence
+        other.rx_timestamp = self.rx_timestamp
+        return other
+
+
+for _name, _fmt, _count, _offset in _SENSOR_FIELDS:
+    if (_count == 1): setattr(EPuckState, _name, _SensorValue(_fmt, _offset))
+del _name, _fmt, _count, _offset
@@ -0,0 +1,121 @@
+import array
+import math
+
+# Link instrumentation. Enabled per robot with EPuck.enable_stats(); when disabled the receive and send paths only
+# check robot.stats for None.
+#
+#   stats = robot.enable_stats()
+#   ...
+#   print(stats)                     #or stats.summary() for a dict
+#   stats.roundtrip.percentile(99)   #s from a command to the next sensor packet
+
+#packet types counted by LinkStats
+PACKET_SENSOR = 0
+PACKET_CAMERA = 1
+PACKET_EMPTY = 2
+PACKET_UNEXPECTED = 3
+_PACKET_NAMES = ("sensor", "camera", "empty", "unexpected")
+
+
+class Histogram():
+    # Fixed memory histogram with logarithmic buckets, for latencies in s. Values outside [low, high] are counted in
+    # the first / last bucket; min, max and mean are exact.
+
+    def __init__(self, low=1e-6, high=10.0, buckets_per_decade=20):
+        self._low = low
+        self._scale = buckets_per_decade
+        self._buckets = array.array('Q', [0]*(int(math.ceil(math.log10(high/low)*buckets_per_decade)) + 1))
+        self.reset()
+
+    def reset(self):
+        for i in range(len(self._buckets)):
+            self._buckets[i] = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def record(self, value):
+        if (value > self._low):
+            index = min(int(math.log10(value/self._low)*self._scale), len(self._buckets) - 1)
+        else:
+            index = 0
+        self._buckets[index] += 1
+        self.count += 1
+        self.total += value
+        if (value < self.min): self.min = value
+        if (value > self.max): self.max = value
+
+    @property
+    def mean(self):
+        return self.total/self.count if self.count else 0.0
+
+    #approximate percentile (0-100), the upper edge of the bucket it falls in, limited to the exact max
+    def percentile(self, p):
+        if (self.count == 0): return 0.0
+        target = self.count*p/100.0
+        seen = 0
+        for index, count in enumerate(self._buckets):
+            seen += count
+            if (seen >= target and count):
+                return min(self._low*10**((index + 1)/self._scale), self.max)
+        return self.max
+
+    def summary(self):
+        return {"count": self.count, "mean": self.mean, "min": self.min if self.count else 0.0, "max": self.max,
+                "p50": self.percentile(50), "p99": self.percentile(99)}
+
+    def __str__(self):
+        if (self.count == 0): return "no samples"
+        return (f"n={self.count} mean={self.mean*1000:.3f}ms p50={self.percentile(50)*1000:.3f}ms "
+                f"p99={self.percentile(99)*1000:.3f}ms max={self.max*1000:.3f}ms")
+
+
+class LinkStats():
+    #counters and latency histograms for one robot link
+
+    def __init__(self):
+        self.write_time = Histogram()   #time spent writing each command or request
+        self.read_time = Histogram()    #time spent reading each packet once it started arriving
+        self.roundtrip = Histogram()    #first write after a sensor packet to the next sensor packet received
+        self.reset()
+
+    def reset(self):
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.packets = [0]*len(_PACKET_NAMES)
+        self.writes = 0
+        self.commands_skipped = 0
+        self.write_time.reset()
+        self.read_time.reset()
+        self.roundtrip.reset()
+
+    def record_write(self, size, duration):
+        self.bytes_out += size
+        self.writes += 1
+        self.write_time.record(duration)
+
+    def record_packet(self, kind, size, duration):
+        self.bytes_in += size
+        self.packets[kind] += 1
+        self.read_time.record(duration)
+
+    def summary(self):
+        return {
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "packets": dict(zip(_PACKET_NAMES, self.packets)),
+            "writes": self.writes,
+            "commands_skipped": self.commands_skipped,
+            "write_time": self.write_time.summary(),
+            "read_time": self.read_time.summary(),
+            "roundtrip": self.roundtrip.summary(),
+        }
+
+    def __str__(self):
+        packets = " ".join(name+"="+str(count) for name, count in zip(_PACKET_NAMES, self.packets))
+        return (f"in {self.bytes_in}B out {self.bytes_out}B, packets {packets}, "
+                f"writes {self.writes}, commands skipped {self.commands_skipped}\n"
+                f"  write     {self.write_time}\n"
+                f"  read      {self.read_time}\n"
+                f"  roundtrip {self.roundtrip}")
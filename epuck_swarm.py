@@ -0,0 +1,117 @@
+import selectors
+
+class EPuckSwarm():
+    # Drives many EPuckIP connections from one selector (epoll on linux). Each update costs one select call for the
+    # whole swarm, and incoming packets are dispatched to the state of the robot whose socket they arrived on.
+    #
+    #   swarm = EPuckSwarm([EPuckIP(ip) for ip in ips])
+    #   swarm.connect_all()
+    #   while True:
+    #       swarm.data_update()
+    #       ...set robot.state actuators...
+    #       swarm.send_commands()
+
+    #bound on select rounds per data_update, for links that deliver faster than they are read. Each round makes one
+    # recv per ready robot, a packet takes at least two (header, body)
+    max_rounds = 200
+
+    def __init__(self, robots=(), debug=False):
+        self._debug = debug
+        self._selector = selectors.DefaultSelector()
+        self._registered = {}   #robot: the socket it is registered with, a reconnect replaces the socket
+        self.robots = []
+        for robot in robots:
+            self.add(robot)
+
+    def __len__(self):
+        return len(self.robots)
+
+    def __iter__(self):
+        return iter(self.robots)
+
+    def _debug_print(self, msg):
+        if(self._debug): print(self.__class__.__name__+": "+msg)
+
+    #add a robot to the swarm. it is registered with the selector once connected
+    def add(self, robot):
+        if (robot._threaded):
+            raise ValueError("threaded EPuckIP robots read their own socket and cannot join a swarm")
+        self.robots.append(robot)
+        if (robot.is_connected()):
+            self._register(robot)
+
+    def remove(self, robot):
+        self._unregister(robot)
+        self.robots.remove(robot)
+
+    #connect all robots that are not yet connected. Returns the number of connected robots
+    def connect_all(self):
+        for robot in self.robots:
+            if (not robot.is_connected() and robot.connect()):
+                self._register(robot)
+        return sum(1 for robot in self.robots if robot.is_connected())
+
+    def close_all(self):
+        for robot in self.robots:
+            self._unregister(robot)
+            robot.close()
+
+    def stop_all(self):
+        self.data_update()
+        for robot in self.robots:
+            robot.state.stop_all()
+            if (robot.is_connected()):
+                robot.send_command(force=True)   #past command_rate and skip_unchanged_commands, like EPuck.stop_all
+
+    #update the sensor/camera state of every robot with everything that has arrived, without blocking
+    def data_update(self):
+        for robot in self.robots:
+            if (robot.is_connected()):
+                self._register(robot)   #picks up sockets replaced by a reconnect
+                robot._sync_streams()
+
+        #each select returns every robot with pending data, make one recv from each and repeat until drained.
+        # Packets are assembled across rounds and updates, so a robot that stalls mid packet delays no other
+        for round in range(self.max_rounds):
+            events = self._selector.select(0)
+            if (not events):
+                break
+            for key, mask in events:
+                robot = key.data
+                if (not robot._receive_step()):
+                    self._debug_print("lost connection to "+str(robot._ip))
+                    self._unregister(robot)
+        for robot in self.robots:
+            robot._finish_receive()
+
+    #send the current actuator state to every connected robot in one pass
+    def send_commands(self):
+        for robot in self.robots:
+            if (robot.is_connected()):
+                robot.send_command()
+
+    #enable link statistics on every robot
+    def enable_stats(self):
+        for robot in self.robots:
+            robot.enable_stats()
+
+    #LinkStats of each robot with stats enabled, keyed by address, to find slow robots and links
+    def stats(self):
+        return {f"{robot._ip}:{robot._port}": robot.stats for robot in self.robots if robot.stats is not None}
+
+    def _register(self, robot):
+        if (self._registered.get(robot) is robot._socket):
+            return
+        self._unregister(robot)
+        if (robot._socket.fileno() >= 0):
+            self._selector.register(robot._socket, selectors.EVENT_READ, robot)
+            self._registered[robot] = robot._socket
+
+    def _unregister(self, robot):
+        sock = self._registered.pop(robot, None)
+        if (sock is None):
+            return
+        try:
+            self._selector.unregister(sock)
+        except (KeyError, ValueError):
+            pass
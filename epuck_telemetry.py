@@ -0,0 +1,144 @@
+import mmap
+import os
+import struct
+import time
+from epuck.epuck_state import EPuckState, _SENSOR_FIELDS, _SENSORS_PACKET_LEN
+
+# Sensor telemetry recording to a memory-mapped file.
+# Each record is a float64 receive timestamp followed by the raw sensor packet as sent by the robot. The file is
+# preallocated and grown by doubling, so recording costs one copy per packet and constant process memory.
+#
+#   recorder = TelemetryRecorder("run1.tlm")
+#   robot.add_sensor_listener(recorder)
+#   ...
+#   recorder.close()
+#
+#   log = TelemetryReader("run1.tlm")
+#   log.timestamps, log["sens_proximity"]   #zero-copy numpy columns
+
+_MAGIC = b"EPUCKTLM"
+_VERSION = 1
+_HEADER = struct.Struct("<8sHHQ")   #magic, version, record size, record count
+_HEADER_LEN = 64
+_TIMESTAMP = struct.Struct("<d")
+_RECORD_LEN = _TIMESTAMP.size + _SENSORS_PACKET_LEN
+
+
+class TelemetryRecorder():
+
+    def __init__(self, path, capacity=65536):   #capacity in records, the file grows when it is exceeded
+        self._path = path
+        self._count = 0
+        self._capacity = max(1, capacity)
+        self._file = open(path, "w+b")
+        self._file.truncate(self._size(self._capacity))
+        self._map = mmap.mmap(self._file.fileno(), self._size(self._capacity))
+        self._write_header()
+
+    def __len__(self):
+        return self._count
+
+    #sensor listener, see EPuck.add_sensor_listener
+    def __call__(self, robot, packet):
+        self.append(packet)
+
+    #append a raw sensor packet
+    def append(self, packet, timestamp=None):
+        if (self._count == self._capacity):
+            self._grow()
+        offset = _HEADER_LEN + self._count*_RECORD_LEN
+        _TIMESTAMP.pack_into(self._map, offset, time.time() if timestamp is None else timestamp)
+        offset += _TIMESTAMP.size
+        if (len(packet) != _SENSORS_PACKET_LEN): packet = memoryview(packet)[:_SENSORS_PACKET_LEN]
+        self._map[offset:offset+_SENSORS_PACKET_LEN] = packet
+        self._count += 1
+        self._write_header()
+
+    def flush(self):
+        self._map.flush()
+
+    #close the file, trimming the unused preallocated space
+    def close(self):
+        if (self._map is None): return
+        self._map.flush()
+        self._map.close()
+        self._map = None
+        self._file.truncate(self._size(self._count))
+        self._file.close()
+
+    def _grow(self):
+        self._map.flush()
+        self._map.close()
+        self._capacity *= 2
+        self._file.truncate(self._size(self._capacity))
+        self._map = mmap.mmap(self._file.fileno(), self._size(self._capacity))
+
+    def _write_header(self):
+        _HEADER.pack_into(self._map, 0, _MAGIC, _VERSION, _RECORD_LEN, self._count)
+
+    def _size(self, records):
+        return _HEADER_LEN + records*_RECORD_LEN
+
+
+class TelemetryReader():
+    # Read a telemetry file. Columns are numpy views into the memory map, nothing is copied.
+    # Can be used while the recorder is still writing, call refresh() to see new records.
+
+    _NUMPY_TYPES = {"h": "<i2", "H": "<u2", "f": "<f4", "B": "u1", "?": "?"}
+
+    def __init__(self, path):
+        import numpy as np   #pip install numpy. Only needed for reading telemetry.
+        self._np = np
+        names = ["timestamp"]
+        formats = ["<f8"]
+        offsets = [0]
+        for name, fmt, count, offset in _SENSOR_FIELDS:
+            names.append(name)
+            formats.append((self._NUMPY_TYPES[fmt], (count,)) if count > 1 else self._NUMPY_TYPES[fmt])
+            offsets.append(_TIMESTAMP.size + offset)
+        names.append("packet")
+        formats.append(("u1", (_SENSORS_PACKET_LEN,)))
+        offsets.append(_TIMESTAMP.size)
+        self.dtype = np.dtype({"names": names, "formats": formats, "offsets": offsets, "itemsize": _RECORD_LEN})
+
+        self._path = path
+        self._file = open(path, "rb")
+        self._map = None
+        self.refresh()
+
+    def __len__(self):
+        return len(self.records)
+
+    #a field column, e.g. reader["sens_proximity"] is an (N, 8) array
+    def __getitem__(self, name):
+        return self.records[name]
+
+    @property
+    def timestamps(self):
+        return self.records["timestamp"]
+
+    @property
+    def fields(self):
+        return self.dtype.names
+
+    #the state of record i as an EPuckState
+    def state(self, i):
+        return EPuckState(self.records["packet"][i])
+
+    #remap the file to pick up records appended since opening. Columns taken before must be released first.
+    def refresh(self):
+        if (self._map is not None):
+            self.records = None
+            self._map.close()
+        size = os.fstat(self._file.fileno()).st_size
+        self._map = mmap.mmap(self._file.fileno(), size, access=mmap.ACCESS_READ)
+        magic, version, record_len, count = _HEADER.unpack_from(self._map, 0)
+        if (magic != _MAGIC or record_len != _RECORD_LEN):
+            raise ValueError(str(self._path)+" is not an e-puck telemetry file")
+        count = min(count, (size - _HEADER_LEN)//_RECORD_LEN)
+        self.records = self._np.frombuffer(self._map, dtype=self.dtype, count=count, offset=_HEADER_LEN)
+
+    def close(self):
+        self.records = None
+        self._map.close()
+        self._file.close()
@@ -0,0 +1,209 @@
+import collections
+import struct
+import time
+from epuck.epuck_state import _SENSOR_FIELDS, _SENSORS_PACKET_LEN
+
+# Sensor triggers: thresholds with hysteresis, change detection and predicates on sensor fields, evaluated as each
+# packet is loaded instead of polling the state after every update. Each watched field's bytes are compared with the
+# previous packet's first, so only fields that changed are decoded and only their triggers evaluated.
+#
+#   triggers = TriggerSet(robots)
+#   triggers.threshold("sens_proximity", above=1000, hysteresis=200, name="obstacle")
+#   triggers.threshold("sens_tof_distance_mm", below=50, callback=lambda event: ...)
+#   triggers.change("sens_button_press")
+#   triggers.predicate(("sens_ground_prox",), lambda state: min(state.sens_ground_prox) < 100, name="edge")
+#   ...
+#   robot.data_update()
+#   for event in triggers.events():
+#       print(event.robot, event.name, event.kind, event.channel, event.value)
+#
+# Events go to the trigger's callback if it has one, else to queue (anything with put_nowait, e.g. queue.Queue) if the
+# set was given one, else they are kept for events(). Callbacks run on the receive path and should be quick.
+
+#kinds of events
+ENTER = "enter"     #threshold crossed or predicate became true
+EXIT = "exit"       #back past the hysteresis band, or predicate became false
+CHANGE = "change"   #value changed
+
+#channel is the index in a vector field, None for scalar fields and predicates
+Event = collections.namedtuple("Event", "robot name kind field channel value timestamp")
+
+_FIELDS = {name: (fmt, count, offset) for name, fmt, count, offset in _SENSOR_FIELDS}
+
+
+class _Trigger():
+
+    def __init__(self, name, fields, channel, callback):
+        self.name = name
+        self.fields = fields
+        self.channel = channel
+        self.callback = callback
+        self._robots = {}   #robot: per channel state, created on the robot's first packet
+
+    #evaluate for one changed field, values is the decoded field. Appends (kind, channel, value) to events
+    def evaluate(self, robot, state, field, values, events):
+        pass
+
+    def _channels(self, values):
+        return range(len(values)) if self.channel is None else (self.channel,)
+
+
+class _Threshold(_Trigger):
+
+    def __init__(self, name, field, channel, callback, above, below, hysteresis):
+        super().__init__(name, (field,), channel, callback)
+        self._above = above
+        self._below = below
+        self._hysteresis = hysteresis
+
+    def _active(self, value, active):
+        if (self._above is not None):
+            return value > self._above if not active else value >= self._above - self._hysteresis
+        return value < self._below if not active else value <= self._below + self._hysteresis
+
+    def evaluate(self, robot, state, field, values, events):
+        active = self._robots.get(robot)
+        if (active is None):
+            active = self._robots[robot] = [False]*len(values)
+        scalar = len(values) == 1
+        for channel in self._channels(values):
+            now = self._active(values[channel], active[channel])
+            if (now != active[channel]):
+                active[channel] = now
+                events.append((ENTER if now else EXIT, None if scalar else channel, values[channel]))
+
+
+class _Change(_Trigger):
+
+    def __init__(self, name, field, channel, callback, delta):
+        super().__init__(name, (field,), channel, callback)
+        self._delta = delta
+
+    def evaluate(self, robot, state, field, values, events):
+        reported = self._robots.get(robot)
+        if (reported is None):   #first packet is the baseline
+            self._robots[robot] = list(values)
+            return
+        scalar = len(values) == 1
+        for channel in self._channels(values):
+            value = values[channel]
+            if (value != reported[channel] and abs(value - reported[channel]) > self._delta):
+                reported[channel] = value
+                events.append((CHANGE, None if scalar else channel, value))
+
+
+class _Predicate(_Trigger):
+
+    def __init__(self, name, fields, callback, test):
+        super().__init__(name, fields, None, callback)
+        self._test = test
+
+    def evaluate(self, robot, state, field, values, events):
+        now = bool(self._test(state))
+        if (now != self._robots.get(robot, False)):
+            self._robots[robot] = now
+            events.append((ENTER if now else EXIT, None, now))
+
+
+class TriggerSet():
+
+    def __init__(self, robots=(), queue=None):
+        self._queue = queue
+        self._events = collections.deque()
+        self._triggers = []
+        self._watched = ()   #(field, start, end, Struct, triggers) of every field a trigger depends on
+        self._last = {}      #robot: previous packet, None until the first one
+        for robot in robots:
+            self.attach(robot)
+
+    def attach(self, robot):
+        if (robot not in self._last):
+            self._last[robot] = None
+            robot.add_sensor_listener(self._on_packet)
+
+    def detach(self, robot):
+        del self._last[robot]
+        robot.remove_sensor_listener(self._on_packet)
+        for trigger in self._triggers:
+            trigger._robots.pop(robot, None)
+
+    #fire ENTER when the value (each channel of a vector field, or only channel) goes above or below the threshold,
+    # and EXIT once it is back by more than hysteresis. Give one of above / below.
+    def threshold(self, field, above=None, below=None, hysteresis=0, channel=None, name=None, callback=None):
+        if ((above is None) == (below is None)):
+            raise ValueError("give one of above or below")
+        return self._add(_Threshold(name or field, self._check(field), channel, callback, above, below, hysteresis))
+
+    #fire CHANGE when the value changes by more than delta from the value last reported
+    def change(self, field, delta=0, channel=None, name=None, callback=None):
+        return self._add(_Change(name or field, self._check(field), channel, callback, delta))
+
+    #fire ENTER when test(state) becomes true and EXIT when it becomes false. test only runs when one of fields changed
+    def predicate(self, fields, test, name=None, callback=None):
+        fields = tuple(self._check(field) for field in fields)
+        return self._add(_Predicate(name or "predicate", fields, callback, test))
+
+    def remove(self, trigger):
+        self._triggers.remove(trigger)
+        self._compile()
+
+    #events queued since the last call, when neither a callback nor a queue takes them
+    def events(self):
+        events = []
+        while (self._events):
+            events.append(self._events.popleft())
+        return events
+
+    def _check(self, field):
+        if (field not in _FIELDS):
+            raise ValueError("unknown sensor field "+str(field))
+        return field
+
+    def _add(self, trigger):
+        self._triggers.append(trigger)
+        self._compile()
+        return trigger
+
+    #group the triggers by field with a decoder for each field
+    def _compile(self):
+        by_field = {}
+        for trigger in self._triggers:
+            for field in trigger.fields:
+                by_field.setdefault(field, []).append(trigger)
+        watched = []
+        for field, triggers in by_field.items():
+            fmt, count, offset = _FIELDS[field]
+            decoder = struct.Struct("<"+str(count)+fmt)
+            watched.append((field, offset, offset + decoder.size, decoder, tuple(triggers)))
+        self._watched = tuple(watched)
+
+    #sensor listener
+    def _on_packet(self, robot, packet):
+        last = self._last[robot]
+        fired = None
+        for field, start, end, decoder, triggers in self._watched:
+            if (last is not None and packet[start:end] == last[start:end]):
+                continue
+            values = decoder.unpack_from(packet, start)
+            for trigger in triggers:
+                events = []
+                trigger.evaluate(robot, robot.state, field, values, events)
+                if (events):
+                    if (fired is None): fired = []
+                    fired.extend((trigger, field, event) for event in events)
+        if (last is None):
+            self._last[robot] = last = bytearray(_SENSORS_PACKET_LEN)
+        last[:] = memoryview(packet)[:_SENSORS_PACKET_LEN]
+        if (fired is not None):
+            self._deliver(robot, fired)
+
+    def _deliver(self, robot, fired):
+        timestamp = time.time()
+        for trigger, field, (kind, channel, value) in fired:
+            event = Event(robot, trigger.name, kind, field, channel, value, timestamp)
+            if (trigger.callback is not None):
+                trigger.callback(event)
+            elif (self._queue is not None):
+                self._queue.put_nowait(event)
+            else:
+                self._events.append(event)
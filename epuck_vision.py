@@ -0,0 +1,148 @@
+import collections
+import multiprocessing
+from multiprocessing import shared_memory
+
+# Runs image processing in a pool of worker processes, so vision doesn't compete with the control loop for the GIL.
+# Each submitted frame is copied once into a slot of a shared memory ring and only the slot index travels to the
+# worker, which decodes it and calls the user callback. Results come back asynchronously.
+#
+#   def find_ball(image, info):      #module level, so the workers can import it
+#       ...
+#       return x, y
+#
+#   vision = VisionPipeline(find_ball, workers=4)
+#   while True:
+#       for robot in robots:
+#           robot.data_update()
+#           vision.submit(robot)             #only new frames are sent
+#       for info, result in vision.results():
+#           ...
+#   vision.close()
+#
+# When every slot is busy new frames are dropped (counted in frames_dropped) rather than queued, so results never
+# lag further behind the robots than the pool's processing time.
+# Tags are any value identifying the frame's source, submit uses the robot by default. Only str and int tags are sent
+# to the workers, the callback sees None for the others.
+
+#description of a processed frame, passed to the callback and returned with its result
+FrameInfo = collections.namedtuple("FrameInfo", "tag sequence timestamp mode width height")
+
+
+class VisionPipeline():
+
+    #callback(image, info) runs in a worker process and must be picklable (a module level function). image is the
+    # decoded frame as a numpy array, or with decode=False a memoryview of the raw frame bytes that is only valid
+    # during the call. Its return value is the result.
+    #workers: number of processes (None for one per core). slots: frames in flight, 2 per worker by default.
+    #slot_bytes: largest frame accepted, the default fits the QQVGA RGB565 frames of the WiFi link.
+    #on_result(info, result), if given, is called on a pool thread instead of queuing results for results().
+    def __init__(self, callback, workers=None, slots=None, slot_bytes=38400, decode=True, on_result=None,
+                 context=None):
+        if (workers is None): workers = multiprocessing.cpu_count()
+        if (slots is None): slots = 2*workers
+        self._slot_bytes = slot_bytes
+        self._on_result = on_result
+        self._slots = slots
+        self._memory = shared_memory.SharedMemory(create=True, size=slots*slot_bytes)
+        self._free = collections.deque(range(slots))
+        self._slot_info = [None]*slots   #FrameInfo of the frame in each slot
+        self._results = collections.deque()
+        self._last_frames = {}   #tag: frame last submitted, to skip frames already sent
+        self.frames_submitted = 0
+        self.frames_dropped = 0
+        self.errors = 0
+        self.last_error = None
+        if (context is None): context = multiprocessing
+        self._pool = context.Pool(workers, initializer=_worker_init, initargs=(self._memory.name, slot_bytes, callback, decode))
+
+    #submit the robot's current camera frame unless it was already submitted. Returns True if it was queued
+    def submit(self, robot, tag=None):
+        state = robot.state
+        if (tag is None): tag = robot
+        frame = state.sens_framebuffer
+        if (frame is None or self._last_frames.get(tag) is frame):
+            return False
+        self._last_frames[tag] = frame
+        info = FrameInfo(tag, state.rx_sequence, state.rx_timestamp, state.cam_mode,
+                         state.cam_width, state.cam_height)
+        return self.submit_frame(frame, info)
+
+    #submit raw frame bytes with their FrameInfo. Returns False if the frame was dropped because every slot is busy
+    def submit_frame(self, frame, info):
+        size = len(frame)
+        if (size > self._slot_bytes):
+            raise ValueError("frame of "+str(size)+" bytes does not fit slots of "+str(self._slot_bytes))
+        try:
+            slot = self._free.popleft()
+        except IndexError:
+            self.frames_dropped += 1
+            return False
+        start = slot*self._slot_bytes
+        self._memory.buf[start:start+size] = frame
+        self.frames_submitted += 1
+        self._slot_info[slot] = info
+        if (not isinstance(info.tag, (str, int))): info = info._replace(tag=None)
+        self._pool.apply_async(_worker_run, ((slot, size, info),),
+                               callback=self._finished, error_callback=lambda error: self._failed(slot, error))
+        return True
+
+    #results that arrived since the last call, as a list of (info, result)
+    def results(self):
+        results = []
+        while (self._results):
+            results.append(self._results.popleft())
+        return results
+
+    #frames submitted and not yet processed
+    def pending(self):
+        return self._slots - len(self._free)
+
+    #wait for the frames in flight, stop the workers and release the shared memory
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+        self._last_frames.clear()
+        self._memory.close()
+        self._memory.unlink()
+
+    #runs on the pool's result thread, as does _failed
+    def _finished(self, response):
+        slot, result = response
+        info = self._slot_info[slot]
+        self._free.append(slot)
+        if (self._on_result is not None):
+            self._on_result(info, result)
+        else:
+            self._results.append((info, result))
+
+    def _failed(self, slot, error):
+        self._free.append(slot)
+        self.errors += 1
+        self.last_error = error
+
+
+### worker process side
+_worker = None   #(shared memory, slot_bytes, callback, FrameDecoder or None), set by _worker_init
+
+def _worker_init(name, slot_bytes, callback, decode):
+    global _worker
+    decoder = None
+    if (decode):
+        from epuck.epuck_camera import FrameDecoder
+        decoder = FrameDecoder()
+    _worker = (shared_memory.SharedMemory(name=name), slot_bytes, callback, decoder)
+
+def _worker_run(task):
+    slot, size, info = task
+    memory, slot_bytes, callback, decoder = _worker
+    start = slot*slot_bytes
+    frame = memory.buf[start:start+size]
+    try:
+        if (decoder is not None):
+            image = decoder.decode(frame, info.mode, info.width, info.height)
+        else:
+            image = frame
+        result = callback(image, info)
+    finally:
+        frame.release()   #views must not outlive the call, the slot is reused
+    return slot, result
@@ -0,0 +1,117 @@
+import os
+import subprocess
+import sys
+import tempfile
+import textwrap
+import unittest
+
+# StatePublisher / StateSubscriber across processes. Each case runs in a fresh interpreter so the resource tracker it
+# starts, and anything that tracker prints to stderr, belongs to the case.
+
+_PACKAGE_PARENT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_CHILD = """
+import multiprocessing
+from epuck.epuck_shared import StatePublisher, StateSubscriber
+from epuck.epuck_state import EPuckState
+
+class Robot():
+    state = EPuckState()
+
+def subscribe(name):
+    subscriber = StateSubscriber(name)
+    assert subscriber.read().sens_proximity[0] == 42
+    subscriber.close()
+
+if __name__ == "__main__":
+    robot = Robot()
+    robot.state.sens_proximity[0] = 42
+    robot.state.rx_sequence = 1
+    publisher = StatePublisher(robot, "{name}", frame_capacity=0)
+    publisher.publish()
+    context = multiprocessing.get_context("{method}")
+    process = context.Process(target=subscribe, args=("{name}",))
+    process.start()
+    process.join()
+    assert process.exitcode == 0
+    publisher.close()
+"""
+
+_PUBLISHER = """
+import sys
+from epuck.epuck_shared import StatePublisher
+from epuck.epuck_state import EPuckState
+
+class Robot():
+    state = EPuckState()
+
+robot = Robot()
+robot.state.rx_sequence = 1
+publisher = StatePublisher(robot, "{name}", frame_capacity=0)
+publisher.publish()
+print("ready", flush=True)
+sys.stdin.readline()   #until the subscriber process has exited
+publisher.close()
+"""
+
+_SUBSCRIBER = """
+from epuck.epuck_shared import StateSubscriber
+StateSubscriber("{name}").close()
+"""
+
+
+#run source as a script file, which spawned children need to import __main__
+def _python(source, directory, **kwargs):
+    script = os.path.join(directory, "script.py")
+    with open(script, "w") as file:
+        file.write(textwrap.dedent(source))
+    environment = dict(os.environ, PYTHONPATH=_PACKAGE_PARENT)
+    return subprocess.Popen([sys.executable, script], env=environment, text=True,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, **kwargs)
+
+
+@unittest.skipUnless(os.name == "posix", "shared memory is only tracked on posix")
+class SharedStateTest(unittest.TestCase):
+
+    def setUp(self):
+        self._temporary = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self._temporary.cleanup()
+
+    def _directory(self, name):
+        directory = os.path.join(self._temporary.name, name)
+        os.mkdir(directory)
+        return directory
+
+    def _check_child(self, method):
+        name = "epuck_test_"+method+"_"+str(os.getpid())
+        process = _python(_CHILD.format(name=name, method=method), self._directory("child"))
+        out, err = process.communicate(timeout=60)
+        self.assertEqual(process.returncode, 0, err)
+        self.assertEqual(err, "")   #no resource tracker warnings after close
+
+    def test_fork_subscriber(self):
+        self._check_child("fork")
+
+    def test_spawn_subscriber(self):
+        self._check_child("spawn")
+
+    #a subscriber with its own tracker must not remove the segment when it exits
+    def test_separate_process_subscriber(self):
+        name = "epuck_test_separate_"+str(os.getpid())
+        publisher = _python(_PUBLISHER.format(name=name), self._directory("publisher"), stdin=subprocess.PIPE)
+        self.assertEqual(publisher.stdout.readline().strip(), "ready")
+        subscriber = _python(_SUBSCRIBER.format(name=name), self._directory("subscriber"))
+        out, err = subscriber.communicate(timeout=60)
+        self.assertEqual(subscriber.returncode, 0, err)
+        self.assertEqual(err, "")
+        self.assertTrue(os.path.exists("/dev/shm/"+name))
+        out, err = publisher.communicate("\n", timeout=60)
+        self.assertEqual(publisher.returncode, 0, err)
+        self.assertEqual(err, "")
+        self.assertFalse(os.path.exists("/dev/shm/"+name))
+
+
+if __name__ == "__main__":
+    unittest.main()